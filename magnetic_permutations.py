@@ -78,17 +78,19 @@ async def Cr2As_mag_permutations():
     mf = MaterialFolder("credentials.json", "Cr2As", structure=cr2as)
     await mf.open()
     
-    for key in configs.keys():
-        await mf.manual_run(
-            key,
-            init_lapw_Parameters(
+    # one init for the whole supercell, only the moment dependent steps are redone per configuration
+    await mf.shared_init_run(
+        "shared_init",
+        {
+            key: init_lapw_Parameters(
                 kpoints=1000,
                 spin_polarized=True,
                 lstart_flag="ask",
                 x_ask_flags_pattern=configs[key],
-            ),
-            auto_confirm=True
-        )
+            )
+            for key in configs.keys()
+        },
+    )
     
     await mf.close()
 
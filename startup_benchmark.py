@@ -0,0 +1,61 @@
+"""
+Measures how long `import wien2k` takes in a fresh interpreter and fails if it is over the budget.
+
+    python startup_benchmark.py [budget in s] [repeats]
+"""
+
+import os, re, subprocess, sys, statistics
+
+IMPORT_BUDGET = 1.0  # s
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure_import(module="wien2k", repeats=5):
+    """Median wall time of importing a module in a fresh interpreter (s)."""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+    times = []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=PACKAGE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        times.append(float(result.stdout.split()[-1]))
+
+    return statistics.median(times)
+
+
+def slowest_imports(module="wien2k", count=10):
+    """The imports with the largest cumulative time, as reported by -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PACKAGE_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    entries = []
+    for line in result.stderr.split("\n"):
+        finds = re.findall(r"import time:\s*(\d+)\s*\|\s*(\d+)\s*\|\s*(.+)", line)
+        if len(finds) != 0:
+            entries.append((int(finds[0][1]) / 1e6, finds[0][2].strip()))
+
+    return sorted(entries, reverse=True)[:count]
+
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else IMPORT_BUDGET
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    import_time = measure_import(repeats=repeats)
+
+    print("Slowest imports (cumulative s):")
+    for seconds, name in slowest_imports():
+        print(f"{seconds:10.4f}  {name}")
+    print(f"import wien2k: {import_time:.4f} s (budget {budget:.4f} s)")
+
+    sys.exit(0 if import_time <= budget else 1)
@@ -0,0 +1,116 @@
+import unittest
+from unittest import mock
+
+import paramiko
+
+from wien2k_connection import SCP_Connection, SSH_Tunnel
+
+
+CRED = {
+    "host1": "gate.example.org",
+    "username1": "user1",
+    "password1": "password1",
+    "host2": "cluster.example.org",
+    "username2": "user2",
+    "password2": "password2",
+}
+
+
+def fake_client():
+    client = mock.MagicMock(spec=paramiko.SSHClient)
+    client.get_transport.return_value.is_active.return_value = True
+    return client
+
+
+class EnsureConnectedTest(unittest.TestCase):
+    def test_connects_both_hops(self):
+        hop1, hop2 = fake_client(), fake_client()
+        with mock.patch.object(paramiko, "SSHClient", side_effect=[hop1, hop2]):
+            tunnel = SSH_Tunnel(CRED)
+            tunnel.ensure_connected()
+
+        self.assertIs(tunnel.hop1, hop1)
+        self.assertIs(tunnel.hop2, hop2)
+        self.assertEqual(tunnel.generation, 1)
+        hop1.get_transport.return_value.open_channel.assert_called_once_with(
+            "direct-tcpip", ("cluster.example.org", 22), ("127.0.0.1", 0)
+        )
+        self.assertEqual(
+            hop2.connect.call_args.kwargs["sock"],
+            hop1.get_transport.return_value.open_channel.return_value,
+        )
+
+    def test_reconnect_closes_the_dead_clients(self):
+        old_hop1, old_hop2 = fake_client(), fake_client()
+        old_hop2.get_transport.return_value.is_active.return_value = False
+        hop1, hop2 = fake_client(), fake_client()
+
+        tunnel = SSH_Tunnel(CRED)
+        tunnel.hop1, tunnel.hop2 = old_hop1, old_hop2
+        with mock.patch.object(paramiko, "SSHClient", side_effect=[hop1, hop2]):
+            tunnel.ensure_connected()
+
+        old_hop1.close.assert_called_once()
+        old_hop2.close.assert_called_once()
+        self.assertIs(tunnel.hop2, hop2)
+
+    def test_retries_a_dropped_connect(self):
+        failing = fake_client()
+        failing.connect.side_effect = paramiko.SSHException("Error reading SSH protocol banner")
+        hop1, hop2 = fake_client(), fake_client()
+
+        with mock.patch.object(
+            paramiko, "SSHClient", side_effect=[failing, hop1, hop2]
+        ), mock.patch("wien2k_connection.time.sleep") as sleep:
+            tunnel = SSH_Tunnel(CRED)
+            tunnel.ensure_connected()
+
+        sleep.assert_called_once_with(SSH_Tunnel.reconnect_base_delay)
+        failing.close.assert_called_once()
+        self.assertIs(tunnel.hop2, hop2)
+
+    def test_does_not_retry_a_rejected_login(self):
+        rejected = fake_client()
+        rejected.connect.side_effect = paramiko.AuthenticationException("Authentication failed.")
+
+        with mock.patch.object(
+            paramiko, "SSHClient", side_effect=[rejected]
+        ), mock.patch("wien2k_connection.time.sleep") as sleep:
+            tunnel = SSH_Tunnel(CRED)
+            with self.assertRaises(paramiko.AuthenticationException):
+                tunnel.ensure_connected()
+
+        sleep.assert_not_called()
+        rejected.close.assert_called_once()
+        self.assertIsNone(tunnel.hop1)
+
+
+class ScaledWaitTest(unittest.TestCase):
+    def setUp(self):
+        self.pings = dict(SCP_Connection.pings)
+
+    def tearDown(self):
+        SCP_Connection.pings = self.pings
+
+    def test_unmeasured_host_keeps_the_base_wait(self):
+        self.assertEqual(SCP_Connection.scaled_wait("unmeasured.example.org", 1.5), 1.5)
+
+    def test_fast_link_shortens_only_the_round_trip(self):
+        SCP_Connection.record_ping("fast.example.org", 0.01)
+        self.assertAlmostEqual(SCP_Connection.scaled_wait("fast.example.org", 1.5), 1.41)
+        self.assertAlmostEqual(
+            SCP_Connection.scaled_wait("fast.example.org", 15, latency_bound=True),
+            15 * SCP_Connection.min_wait_scale,
+        )
+
+    def test_slow_link_lengthens_the_waits(self):
+        SCP_Connection.record_ping("slow.example.org", 0.5)
+        self.assertAlmostEqual(SCP_Connection.scaled_wait("slow.example.org", 1.5), 1.9)
+        self.assertAlmostEqual(
+            SCP_Connection.scaled_wait("slow.example.org", 15, latency_bound=True),
+            15 * SCP_Connection.max_wait_scale,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,36 @@
 # message box
 import ctypes
-import string, random, re, sys, itertools
-from thefuzz import fuzz
+import string, random, re, sys, itertools, importlib
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access.
+    Keeps heavy and platform specific dependencies out of the package import."""
+
+    def __init__(self, name):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+
+    def _load(self):
+        if self._module == None:
+            object.__setattr__(self, "_module", importlib.import_module(self._name))
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return f"<LazyModule {self._name} {'loaded' if self._module != None else 'not loaded'}>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+fuzz = lazy_import("thefuzz.fuzz")
 
 TESSERACT_PATH = "C:/Program Files/Tesseract-OCR/tesseract.exe"
 WINDOWS_LINE_ENDING = b"\r\n"
@@ -14,6 +43,7 @@ class Constants:
     angstrom_to_bohr = 1.8897
     eV_to_Ry = 0.0734985857
     Ry_to_eV = 13.605703976
+    eV_per_A3_to_GPa = 160.21766208
 
 
 def lfilt(iter, func):
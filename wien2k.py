@@ -2,6 +2,8 @@ from wien2_helper import *
 from wien2k_connection import *
 from wien2k_params import *
 from wien2k_struct import *
+from wien2k_phonons import *
+from wien2k_eos import *
 
 import time, re, json, timeit
 from datetime import datetime
@@ -25,110 +27,232 @@ class MaterialFolder:
         else:
             raise Exception("No structure was given!")
 
-    def open(self) -> asyncio.Future:
-        # connect to the server
-        self.cmd = CMD_Window()
-        self.scp = SCP_Connection(self.cmd, self.credentials_path)
-        self.scp.connect_twohop()
-        self.ssh = dSSH_Connection(self.cmd, self.credentials_path)
-        self.ssh.connect()
-
-        # make a new scratch folder
-        self.make_wien_scratch()
+    async def open(self):
+        # borrow a logged-in session (console, SCP link and scratch) from the pool
+        self.session = await SessionPool.acquire(self.credentials_path)
+        self.cmd = self.session.cmd
+        self.scp = self.session.scp
+        self.ssh = self.session.ssh
 
         # make the material folder (if that folder already exists, it'll just be automatically ignored)
         self.cmd.home()
         self.cmd.type(f"mkdir {self.material}")
-        return self.cmd.cd(f"{self.material}")
+        return await self.cmd.cd(f"{self.material}")
 
     # ---------------- CLEANING AND EXITING ----------------
     def clean(self) -> asyncio.Future:
-        return self.cleanup_wien_scratch()
-
-    def close(self) -> asyncio.Future:
-        self.clean()
+        return self.session.reset()
 
-        self.ssh.disconnect()
-        self.scp.disconnect()
+    async def close(self):
+        # hand the session back to the pool instead of logging out
+        await SessionPool.release(self.session)
 
-        return self.cmd.kill()
+    # ---------------- RUNNING SCF INTERNAL ----------------
 
-    # ---------------- WIEN SCRATCH ----------------
-    def make_wien_scratch(self) -> asyncio.Future:
-        # create wien2k scratch
-        WS_basepath = "/home/sedlacek/"
-        tmpdir_name = rng_string(16)
-        self.WS_tmppath = WS_basepath + f"WS_{self.material}_{tmpdir_name}"
+    # the runs are detached from the console, these files in the run directory keep track of them
+    LAPW_PID_FILE = "lapw.pid"
+    LAPW_LOG_FILE = "lapw.log"
+    LAPW_LAUNCH_FILE = "lapw.launched"  # a run was launched here, its pid may not be written yet
+    LAPW_LAUNCH_TIMEOUT = 1800  # s, the launch line may wait behind a long init in the console's queue
+
+    async def _launch_lapw(self, is_sp, is_so, is_orb, extra_flags="", scratch=None):
+        # the typed line may run long after this returns (the console works through its queue),
+        # the files of the previous run are removed out of band first so no check mistakes them for this run's
+        reset = (
+            f"rm -f {MaterialFolder.LAPW_PID_FILE} {self.material}.dayfile {MaterialFolder.LAPW_LOG_FILE}; "
+            + f"touch {MaterialFolder.LAPW_LAUNCH_FILE}"
+        )
+        await self.scp.exec(reset)
+
+        # nohup keeps the run going if the console's connection drops, the pid is kept to reattach to it
+        command = f"run{'sp' if is_sp else ''}_lapw {'-so' if is_so else ''} {'-orb' if is_orb else ''} {extra_flags}"
+        # runs going side by side from one session need their own scratch (the vector files are named by the case)
+        if scratch != None:
+            reset = f"{reset}; mkdir -p {scratch}"
+            command = f"env SCRATCH={scratch} {command}"
+        return await self.cmd.type(
+            f"{reset}; nohup {command} > {MaterialFolder.LAPW_LOG_FILE} 2>&1 < /dev/null & echo $! > {MaterialFolder.LAPW_PID_FILE}"
+        )
 
-        self.cmd.type(f"mkdir {self.WS_tmppath}")
-        self.cmd.type(f"export SCRATCH={self.WS_tmppath}")
-        return self.cmd.type(f"export EDITOR=nano")
+    CONSOLE_DONE_FILE = "console.done"
 
-    def cleanup_wien_scratch(self) -> asyncio.Future:
-        self.cmd.home()
-        return self.cmd.type(f"rm {self.WS_tmppath} -rf")
+    async def _await_console(self, timeout=5):
+        """Waits until the console has worked through everything typed so far (a typed future only means
+        the line was typed, not that its command has finished), a marker typed last shows up when it has."""
+        run_dir = self.cmd.curr_dir
+        await self.cmd.type(f"touch {MaterialFolder.CONSOLE_DONE_FILE}")
+        while True:
+            await asyncio.sleep(
+                SCP_Connection.scaled_wait(
+                    self.cmd.associated_host, timeout, latency_bound=True
+                )
+            )
+            try:
+                (_, out, _) = await self.scp.exec(
+                    f"test -e {MaterialFolder.CONSOLE_DONE_FILE} && rm -f {MaterialFolder.CONSOLE_DONE_FILE} && echo DONE",
+                    run_dir,
+                )
+            except Exception as e:
+                print(f"Error while waiting for the console ({e}), checking again")
+                continue
+            if "DONE" in out.split("\n"):
+                return
+
+    async def _is_lapw_running(self, run_dir=None) -> bool:
+        (_, out, _) = await self.scp.exec(
+            f"kill -0 $(cat {MaterialFolder.LAPW_PID_FILE} 2>/dev/null) 2>/dev/null && echo RUNNING",
+            run_dir,
+        )
+        return "RUNNING" in out
 
-    # ---------------- RUNNING SCF INTERNAL ----------------
+    async def _await_lapw_end(
+        self, run_dir=None, timeout=15, launch_timeout=LAPW_LAUNCH_TIMEOUT
+    ) -> Tuple[float, str]:
+        """Waits for the detached run in run_dir (the current directory by default) to end.
+        A launched run only counts as ended once its pid was seen, before that it is still pending
+        (for at most launch_timeout s, then the launch line is taken as lost and the run failed).
+        Checks go through the SSH tunnel, so a dropped connection only delays them until it reconnects."""
+        run_dir = self.cmd.curr_dir if run_dir == None else run_dir
 
-    async def _await_lapw_end(self, timeout=15) -> Tuple[float, str]:
         # set the start time:
         start_time = timeit.default_timer()
         print(
-            "If the calculation finishes and the rest of the program is not able to recognize that, type 'manual_stop' into the ssh console to stop it manually and wait for the next check."
+            f"To stop the calculation manually, create a 'manual_stop' file in {run_dir} and wait for the next check."
         )
 
+        last_cycle = None
+        pid_seen = False
         while True:
-            # wait for some time
-            await asyncio.sleep(timeout)
+            # wait for some time (shorter on fast links)
+            await asyncio.sleep(
+                SCP_Connection.scaled_wait(
+                    self.cmd.associated_host, timeout, latency_bound=True
+                )
+            )
 
             try:
-                # read the status of the screen
-                lines = await self.cmd.read_output(5)
-                lines = "\n".join(lines)
-
-                success_status = (
-                    does_text_contain(f"{self.material}$", lines, 85)
-                    and not does_text_contain("run_lapw", lines, 85)
-                    and not does_text_contain("runsp_lapw", lines, 85)
-                ) or does_text_contain("> stop", lines, 80)
-                not_converged_status = does_text_contain("SCF NOT CONVERGED", lines, 80)
-                error_status = does_text_contain("stop error", lines, 80)
-                manual_stop_status = does_text_contain("manual_stop", lines, 80)
-
-                if any(
-                    [
-                        success_status,
-                        not_converged_status,
-                        error_status,
-                        manual_stop_status,
-                    ]
-                ):
-                    status = "unknown"
-                    if manual_stop_status:
-                        status = "manual_stop"
-                    elif not_converged_status:
-                        status = "not_converged"
-                    elif error_status:
-                        status = "error"
-                    elif success_status:
-                        status = "success"
-                    self.cmd.cd(".")
-                    self.cmd.type("^C", do_ENTER=False)
-                    self.cmd.cd(".")
-
-                    end_time = timeit.default_timer()
-                    return (round(end_time - start_time, 2), status)
-            except:
-                # in case of an error of the reading, continue checking
-                print("Error while waiting")
-                pass
-
-    def _save_run_diagnostics(
-        self, run_name, run_uid, status, runtime, params, params_so, params_orb
+                (_, out, _) = await self.scp.exec(
+                    f"kill -0 $(cat {MaterialFolder.LAPW_PID_FILE}) 2>/dev/null && echo RUNNING; "
+                    + f"test -s {MaterialFolder.LAPW_PID_FILE} && echo PID; "
+                    + f"test -e {MaterialFolder.LAPW_LAUNCH_FILE} && echo LAUNCHED; "
+                    + f"test -e manual_stop && echo MANUAL_STOP; "
+                    + f"tail -n 8 {self.material}.dayfile {MaterialFolder.LAPW_LOG_FILE} 2>/dev/null",
+                    run_dir,
+                )
+            except Exception as e:
+                # the tunnel reconnects on its own, the detached run is picked up again at the next check
+                print(f"Error while waiting ({e}), reattaching at the next check")
+                continue
+
+            lines = out.split("\n")
+
+            # the launch line has not run in the console yet
+            pid_seen = pid_seen or "PID" in lines
+            if not pid_seen:
+                end_time = timeit.default_timer()
+                if "LAUNCHED" not in lines:
+                    print(f"No run was launched in {run_dir}.")
+                    return (round(end_time - start_time, 2), "error")
+                if end_time - start_time < launch_timeout:
+                    continue
+
+                print(f"The run in {run_dir} did not start within {launch_timeout} s of its launch.")
+                try:
+                    await self.scp.exec(f"rm -f {MaterialFolder.LAPW_LAUNCH_FILE}", run_dir)
+                except Exception as e:
+                    print(f"Error while clearing the launch marker ({e})")
+                return (round(end_time - start_time, 2), "error")
+
+            # report progress
+            cycles = re.findall(r"in cycle (\d+)", out)
+            if len(cycles) > 0 and cycles[-1] != last_cycle:
+                last_cycle = cycles[-1]
+                print(f"{run_dir}: cycle {last_cycle}")
+
+            status = None
+            if "MANUAL_STOP" in lines:
+                status = "manual_stop"
+                # the detached run is the leader of its own process group
+                await self.scp.exec(
+                    f"kill -- -$(cat {MaterialFolder.LAPW_PID_FILE}); rm manual_stop",
+                    run_dir,
+                )
+            elif "SCF NOT CONVERGED" in out:
+                status = "not_converged"
+            elif "stop error" in out:
+                status = "error"
+            elif "RUNNING" not in lines:
+                status = "success" if re.search(r">\s*stop\s*$", out, re.M) else "error"
+
+            if status != None:
+                end_time = timeit.default_timer()
+                return (round(end_time - start_time, 2), status)
+
+    async def reattach(self, run_path) -> Tuple[float, str]:
+        """Picks up the monitoring of a detached run (e.g. one started before the script was restarted).
+        run_path is relative to the home directory, as the absolute_path in the run details."""
+        return await self._await_lapw_end(run_path)
+
+    def _set_rkmax(self, rkmax) -> asyncio.Future:
+        # RMT*KMAX is the first number on the second line of case.in1 (case.in1c without inversion)
+        return self.cmd.type(
+            f"for f in {self.material}.in1 {self.material}.in1c; do test -e $f && sed -i '2s/^ *[0-9.]*/{float(rkmax):6.2f}/' $f; done"
+        )
+
+    def _set_kmesh(self, kpoints, kdensity, kshift, is_so) -> asyncio.Future:
+        # only the k-list is regenerated, the density and the other inputs stay
+        self.cmd.type(f"x kgen {'-so' if is_so else ''}")
+        self.cmd.type(str(int(kpoints)))
+        if int(kpoints) == -1:
+            self.cmd.type(str(float(kdensity)))
+        return self.cmd.type("1" if kshift else "0")
+
+    async def _warm_start(self, run_path) -> dict:
+        """Seeds the current run with the density of the finished run at run_path (relative to home).
+        The densities are copied when both structs are the same, otherwise they are interpolated
+        onto the new struct with clminter. Returns the record kept in the run details."""
+        source = f"$HOME/{run_path}/{self.material}"
+        # compared from the cell line on, the titles may differ
+        (code, _, _) = await self.scp.exec(
+            f'test "$(tail -n +4 {source}.struct)" = "$(tail -n +4 {self.material}.struct)"'
+        )
+
+        if code == 0:
+            method = "copy"
+            await self.cmd.type(
+                f"for f in clmsum clmup clmdn; do test -e {source}.$f && cp {source}.$f {self.material}.$f; done"
+            )
+        else:
+            # clminter reads the old struct as case.struct and the new one as case.struct_new
+            method = "clminter"
+            await self.cmd.type(
+                f"cp {self.material}.struct {self.material}.struct_new; cp {source}.struct {self.material}.struct; "
+                + f"for f in sum up dn; do test -e {source}.clm$f || continue; cp {source}.clm$f {self.material}.clm$f; "
+                + f"x clminter $(test $f = sum || echo -$f) && mv {self.material}.clm${{f}}_new {self.material}.clm$f; done; "
+                + f"mv {self.material}.struct_new {self.material}.struct"
+            )
+
+        return {"from": run_path, "method": method}
+
+    async def _save_run_diagnostics(
+        self,
+        run_name,
+        run_uid,
+        status,
+        runtime,
+        params,
+        params_so,
+        params_orb,
+        warm_start=None,
+        shared_init=None,
+        convergence_stage=None,
+        recovery=None,
+        fingerprint=None,
     ):
         """
         This function should be called in the directory where a run has finished.
         This function is automatically called after _run_safe.
+        fingerprint overrides the one of the structure (a configuration of a shared init, see shared_init_run).
         """
 
         # assess the high level location
@@ -136,25 +260,23 @@ class MaterialFolder:
         is_orb = params_orb != None
         is_so = params_so != None
 
-        # save run diagnostics
-        last_lines = self.cmd._read_output(32)
-        stack = "\n".join(last_lines[::-1])
-
-        def cycles_find(l):
-            finds = re.findall(r"in cycle (\d*)", l)
-            if len(finds) == 0:
-                return -1
-            else:
-                return int(finds[0])
-
-        cycles = max(lmap(last_lines, cycles_find))
+        # save run diagnostics (from the dayfile and the log, the console is not attached to the run)
+        (_, stack, _) = await self.scp.exec(
+            f"tail -n 32 {self.material}.dayfile {MaterialFolder.LAPW_LOG_FILE}"
+        )
+        (_, cycle_lines, _) = await self.scp.exec(
+            f"grep 'in cycle' {self.material}.dayfile | tail -n 1"
+        )
+        cycles = max(lmap(re.findall(r"in cycle (\d+)", cycle_lines), int) + [-1])
 
         # save results to some local database
         # downlaod the SCF file
-        self.scp.download_file(f"{self.material}.scf", f"{self.material}.scf")
-        with open(f"{self.material}.scf", "r") as f:
+        # (unique local name, other folders of the same material may be downloading at the same time)
+        scf_tmp_path = f"{rng_string(32)}.scf"
+        await self.scp.download(f"{self.material}.scf", scf_tmp_path)
+        with open(scf_tmp_path, "r") as f:
             content = f.read()
-        os.remove(f"{self.material}.scf")
+        os.remove(scf_tmp_path)
 
         # extract important data
         fer_Ry = float(re.findall(r":FER.+(\d*\.\d*)", content)[-1])
@@ -171,8 +293,17 @@ class MaterialFolder:
                 "struct": {
                     "plaintext": self.structure.generate_poscar(),
                     "tweaks_log": self.structure.get_logs(),
+                    "fingerprint": self.structure.fingerprint()
+                    if fingerprint == None
+                    else fingerprint,
                 },
                 "init_lapw": params.text_params,
+                # the finished run the density was seeded from (None for a run from scratch)
+                "warm_start": warm_start,
+                # the run directory of the init shared by several magnetic configurations (see shared_init_run)
+                "shared_init": shared_init,
+                # the loose/strict stage of a staged sweep (see Sweep.run_staged)
+                "convergence_stage": convergence_stage,
                 "init_so_lapw": params_so.text_params if is_so else {},
                 "UJ": {
                     "U_eV": params_orb.U if is_orb else 0,
@@ -185,6 +316,8 @@ class MaterialFolder:
                 "runtime": runtime,
                 "status": status,
                 "end_stack": stack,
+                # the mixer retuning relaunches of a not converged run (see _recover_mixing)
+                "recovery": [] if recovery == None else recovery,
             },
             "results": {
                 "fermi_energy_eV": fer_Ry * Constants.Ry_to_eV,
@@ -209,51 +342,59 @@ class MaterialFolder:
                     ],
                     float,
                 ),
+                # supercell atom indices (from 0, .poscar order) of the equivalence class of each MM_atoms entry
+                "MM_atoms_groups": lmap(
+                    self.structure.get_equivalent_atom_groups(),
+                    lambda group: lmap(group, int),
+                ),
             },
         }
 
+        # forces on the non-equivalent atoms in the struct order (only in runs with -fc)
+        if ":FGL" in content:
+            run_details["results"]["forces_eV_per_A"] = parse_forces(
+                content, self.structure.non_eq_count
+            ).tolist()
+
         # save the json data on the server
         with open(f"_{run_uid}_details.json", "w") as f:
             json.dump(run_details, f)
-        self.scp.upload_file(f"_{run_uid}_details.json", f"_{run_uid}_details.json")
+        await self.scp.upload(f"_{run_uid}_details.json", f"_{run_uid}_details.json")
 
         # TODO: output file structuring
 
-    async def _run_safe(
+        return run_details
+
+    async def _initialize(
         self,
-        run_name,
-        params: init_lapw_Parameters = None,
+        params: init_lapw_Parameters,
         params_so: init_so_lapw_Parameters = None,
         params_orb: UJ_Parameters = None,
-    ) -> asyncio.Future:
-        run_uid = "run_" + rng_string(16)
+        moment_pattern=None,
+    ):
+        """Clears the current directory, uploads the struct (with the moment pattern) and runs all the init steps.
+        Returns params_so as used (inheriting from params)."""
+        is_orb = params_orb != None
+        is_so = params_so != None
+
+        # reject impossible sphere overlaps before spending a remote init on them
+        self.structure.check_overlaps(keep_radii=params.text_params["accept_radii"] == "d")
 
         # remove old files and upload the new struct file
         self.cmd.bring_forward()
         await self.cmd.type(f"rm * -rf")
 
-        # get and save the edited struct
-        tmp_path = f"{rng_string(32)}.poscar"
+        self.structure.set_magnetic_moments(moment_pattern)
+
+        # write the edited struct locally and upload it as the case struct
+        tmp_path = f"{rng_string(32)}.struct"
         with open(tmp_path, "w") as f:
-            f.write(self.structure.generate_poscar())
+            f.write(self.structure.generate_struct())
 
-        # ulpoad poscar and remove temp file
-        self.scp.upload_file(tmp_path, f"{self.material}.poscar")
+        # ulpoad struct and remove temp file
+        await self.scp.upload(tmp_path, f"{self.material}.struct")
         os.remove(tmp_path)
 
-        # convert poscar to struct
-        self.cmd.type(f"xyz2struct < {self.material}.poscar 1e-9")
-        while await does_console_contain("be exactly", self.cmd, 2, 80):
-            self.cmd.type(f"n")
-
-        self.cmd.type(f"mv xyz2struct.struct {self.material}.struct")
-        # TODO: add visual check for any questions
-
-        # assess the high level location
-        is_sp = params.raw_params["spin_polarized"]
-        is_orb = params_orb != None
-        is_so = params_so != None
-
         # run all init processes
         # use await to ensure that the initialization is finished before running "run_lapw"
         await params.execute(self)
@@ -263,17 +404,199 @@ class MaterialFolder:
             params_so = params_so.reinstantiate(params)
             await params_so.execute(self)
         if is_orb:
-            params_orb.execute(self)
+            await params_orb.execute(self)
+
+        await self._set_rkmax(params.raw_params["rkmax"])
+        return params_so
 
-        await self.cmd.type(
-            f"run{'sp' if is_sp else ''}_lapw {'-so' if is_so else ''} {'-orb' if is_orb else ''}"
+    async def _run_safe(
+        self,
+        run_name,
+        params: init_lapw_Parameters = None,
+        params_so: init_so_lapw_Parameters = None,
+        params_orb: UJ_Parameters = None,
+        extra_run_flags="",
+        warm_start_from=None,
+        convergence_stage=None,
+    ) -> asyncio.Future:
+        run_uid = "run_" + rng_string(16)
+
+        # assess the high level location
+        is_sp = params.raw_params["spin_polarized"]
+        is_orb = params_orb != None
+        is_so = params_so != None
+
+        # a run still going in this directory (e.g. from before a dropped connection) is reattached to, not started again
+        if await self._is_lapw_running():
+            print(f"A run is still going in {self.cmd.curr_dir}, reattaching to it.")
+            (runtime, status) = await self._await_lapw_end()
+            await self.session.ensure_console()
+            # nothing was initialized here, the non-equivalent atoms (for MM_atoms and forces) are found as _initialize would
+            self.structure.set_magnetic_moments(
+                params.raw_params["x_ask_flags_pattern"]
+                if params.text_params["lstart_flag"] == "-ask"
+                else None
+            )
+            return await self._save_run_diagnostics(
+                run_name, run_uid, status, runtime, params, params_so, params_orb
+            )
+
+        # atoms with different -ask moments must not be made equivalent by the symmetry reduction
+        params_so = await self._initialize(
+            params,
+            params_so,
+            params_orb,
+            params.raw_params["x_ask_flags_pattern"]
+            if params.text_params["lstart_flag"] == "-ask"
+            else None,
+        )
+
+        # start from the converged density of a finished run (path relative to home) instead of the dstart one
+        warm_start = None
+        if warm_start_from != None:
+            warm_start = await self._warm_start(warm_start_from)
+
+        return await self._continue_run(
+            run_name,
+            params,
+            params_so,
+            params_orb,
+            extra_run_flags,
+            run_uid,
+            warm_start,
+            convergence_stage,
+        )
+
+    async def _continue_run(
+        self,
+        run_name,
+        params: init_lapw_Parameters,
+        params_so: init_so_lapw_Parameters = None,
+        params_orb: UJ_Parameters = None,
+        extra_run_flags="",
+        run_uid=None,
+        warm_start=None,
+        convergence_stage=None,
+    ):
+        """Launches run_lapw in the current directory from the files already there (the density of the last run)
+        and saves the diagnostics once it ends."""
+        run_uid = "run_" + rng_string(16) if run_uid == None else run_uid
+
+        await self._launch_lapw(
+            params.raw_params["spin_polarized"],
+            params_so != None,
+            params_orb != None,
+            extra_run_flags,
         )
         (runtime, status) = await self._await_lapw_end()
+        await self.session.ensure_console()
+        (runtime, status, recovery) = await self._recover_mixing(
+            runtime, status, params, params_so, params_orb, extra_run_flags
+        )
 
-        self._save_run_diagnostics(
-            run_name, run_uid, status, runtime, params, params_so, params_orb
+        return await self._save_run_diagnostics(
+            run_name,
+            run_uid,
+            status,
+            runtime,
+            params,
+            params_so,
+            params_orb,
+            warm_start,
+            convergence_stage=convergence_stage,
+            recovery=recovery,
         )
 
+    # ---------------- MIXER RECOVERY ----------------
+
+    # relaunches of a not converged run, each halving the mixing factor (the last one also switches to PRATT)
+    RECOVERY_ATTEMPTS = 3
+    MIXING_BACKOFF = 0.5
+    MIN_MIXING_FACTOR = 0.02
+    FALLBACK_MIXER = "PRATT"
+
+    async def _convergence_history(self, cycles=8):
+        """(charge distances, total energies in Ry) of the last cycles in the case.scf of the current directory."""
+        (_, out, _) = await self.scp.exec(
+            f"grep -E ':DIS|:ENE' {self.material}.scf | tail -n {2 * cycles}"
+        )
+        distances = lmap(re.findall(r":DIS.+?\(\s*([\d.Ee+-]+)", out), float)
+        energies = lmap(re.findall(r":ENE[\D]+([- ]\d*\.\d*)", out), float)
+        return (distances, energies)
+
+    @staticmethod
+    def _next_mixing(distances, mixer, factor, attempt, attempts):
+        """Mixer and factor of the next attempt: unchanged while the charge distance still falls steadily
+        (the run only needs more cycles), else a backed off factor and on the last attempt the fallback mixer."""
+        if len(distances) >= 3 and np.all(np.diff(distances) < 0):
+            return (mixer, factor)
+        factor = max(factor * MaterialFolder.MIXING_BACKOFF, MaterialFolder.MIN_MIXING_FACTOR)
+        if attempt == attempts - 1:
+            mixer = MaterialFolder.FALLBACK_MIXER
+        return (mixer, factor)
+
+    async def _recover_mixing(
+        self, runtime, status, params, params_so, params_orb, extra_run_flags, scratch=None
+    ):
+        """Relaunches a not converged run in the current directory from its last density with the mixing
+        in case.inm retuned (see _next_mixing), up to RECOVERY_ATTEMPTS times.
+        Returns the total runtime, the final status and the record of every attempt."""
+        recovery = []
+        for attempt in range(MaterialFolder.RECOVERY_ATTEMPTS):
+            if status != "not_converged":
+                break
+
+            # the first word of case.inm is the mixer, the first of the second line its mixing factor
+            (_, out, _) = await self.scp.exec(f"head -n 2 {self.material}.inm")
+            lines = out.split("\n")
+            (mixer, factor) = (lines[0].split()[0], float(lines[1].split()[0]))
+            (distances, energies) = await self._convergence_history()
+            (new_mixer, new_factor) = MaterialFolder._next_mixing(
+                distances, mixer, factor, attempt, MaterialFolder.RECOVERY_ATTEMPTS
+            )
+
+            if (new_mixer, new_factor) != (mixer, factor):
+                await self.scp.exec(
+                    f"sed -i -e '1s/^ *[^ ]*/{new_mixer}/' -e '2s/^ *[0-9.]*/{new_factor:.3f}/' {self.material}.inm"
+                )
+            # the broyden history of the old mixer would steer the fallback one, with the same mixer it is kept
+            # (run_lapw deletes case.broyd* on startup unless -NI is given)
+            if new_mixer != mixer:
+                await self.scp.exec(f"rm -f {self.material}.broyd*")
+                run_flags = extra_run_flags
+            else:
+                run_flags = f"{extra_run_flags} -NI"
+            print(
+                f"{self.cmd.curr_dir}: not converged, attempt {attempt + 1} with {new_mixer} {new_factor:.3f} (was {mixer} {factor})"
+            )
+
+            await self._launch_lapw(
+                params.raw_params["spin_polarized"],
+                params_so != None,
+                params_orb != None,
+                run_flags,
+                scratch,
+            )
+            (attempt_runtime, status) = await self._await_lapw_end()
+            await self.session.ensure_console()
+            runtime = round(runtime + attempt_runtime, 2)
+
+            recovery.append(
+                {
+                    "attempt": attempt + 1,
+                    "history": {
+                        "charge_distances": distances,
+                        "energies_Ry": energies,
+                    },
+                    "mixer": [mixer, new_mixer],
+                    "mixing_factor": [factor, new_factor],
+                    "runtime": attempt_runtime,
+                    "status": status,
+                }
+            )
+
+        return (runtime, status, recovery)
+
     # ---------------- RUNNING SCF ----------------
 
     async def manual_run(
@@ -283,6 +606,9 @@ class MaterialFolder:
         params_so: init_so_lapw_Parameters = None,
         params_orb: UJ_Parameters = None,
         auto_confirm=False,
+        extra_run_flags="",
+        warm_start_from=None,
+        convergence_stage=None,
     ) -> asyncio.Future:
         if params == None:
             # ask if they want to put in the parameters manually
@@ -334,11 +660,353 @@ class MaterialFolder:
         else:
             decision = 6
 
+        run_details = None
         if decision == 6:
-            await self._run_safe(run_name, params, params_so, params_orb)
+            run_details = await self._run_safe(
+                run_name,
+                params,
+                params_so,
+                params_orb,
+                extra_run_flags,
+                warm_start_from,
+                convergence_stage,
+            )
 
         # return to the main material directory
-        return self.cmd.cd("../../..")
+        await self.cmd.cd("../../..")
+        return run_details
+
+    # ---------------- CONVERGENCE ----------------
+
+    @staticmethod
+    def convergence_path(material_name):
+        return f"{material_name}_convergence.json"
+
+    @staticmethod
+    def load_convergence(material_name):
+        """The values chosen by the last convergence study of the material (None if there was none).
+        The "params" can be passed on: init_lapw_Parameters(**record["params"], ...)."""
+        path = MaterialFolder.convergence_path(material_name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _energy_per_atom(self, run_details):
+        return run_details["results"]["energy_per_cell_eV"] / len(self.structure.atoms)
+
+    async def _converge_series(
+        self,
+        run_name,
+        values,
+        apply,
+        start,
+        tolerance_eV,
+        params,
+        params_so,
+        params_orb,
+        extra_run_flags,
+    ):
+        """Continues the run for every value (applied by apply(value)) until the energy per atom changes
+        by less than tolerance_eV. start is the (value, run details) the series begins from.
+        Returns the chosen value, its run details and the steps."""
+        steps = [{"value": start[0], "details": start[1]}]
+        (chosen, chosen_details) = start
+        last_energy = self._energy_per_atom(chosen_details)
+
+        for value in values:
+            apply(value)
+            details = await self._continue_run(
+                f"{run_name}_{value}", params, params_so, params_orb, extra_run_flags
+            )
+            steps.append({"value": value, "details": details})
+            if details["diagnostics"]["status"] != "success":
+                print(
+                    f"Convergence study {run_name}: the run at {value} ended with {details['diagnostics']['status']}, stopping."
+                )
+                return (chosen, chosen_details, steps)
+
+            energy = self._energy_per_atom(details)
+            if abs(energy - last_energy) < tolerance_eV:
+                return (chosen, chosen_details, steps)
+            (chosen, chosen_details, last_energy) = (value, details, energy)
+
+        print(
+            f"Convergence study {run_name}: not converged to {tolerance_eV} eV/atom, the last value is used."
+        )
+        return (chosen, chosen_details, steps)
+
+    def _series_record(self, steps):
+        return [
+            {
+                "value": step["value"],
+                "energy_per_atom_eV": self._energy_per_atom(step["details"]),
+                "status": step["details"]["diagnostics"]["status"],
+            }
+            for step in steps
+        ]
+
+    async def convergence_study(
+        self,
+        run_name,
+        params: init_lapw_Parameters,
+        params_so: init_so_lapw_Parameters = None,
+        params_orb: UJ_Parameters = None,
+        kpoints=(200, 500, 1000, 2000, 5000),
+        kdensities=None,
+        rkmax=(7.5, 8.0, 8.5, 9.0),
+        tolerance_eV=1e-3,
+        extra_run_flags="",
+    ):
+        """Converges the k-mesh and then RKmax, starting from the values of params (one full init and run).
+        Every next k-mesh (kpoints, or kdensities as delta-k) only regenerates the k-list with kgen and every
+        next RKmax only edits case.in1, both continue from the density of the previous run.
+        A series stops once the energy per atom changes by less than tolerance_eV, the value before that step is chosen.
+        The chosen values are saved to {material}_convergence.json (see load_convergence)."""
+        is_so = params_so != None
+        kshift = params.raw_params["kshift"]
+
+        first = await self.manual_run(
+            run_name,
+            params,
+            params_so,
+            params_orb,
+            auto_confirm=True,
+            extra_run_flags=extra_run_flags,
+        )
+        if first["diagnostics"]["status"] != "success":
+            raise Exception(
+                f"Convergence study {run_name}: the initial run ended with {first['diagnostics']['status']}."
+            )
+
+        # continue in the run directory
+        self.cmd.home()
+        await self.cmd.cd(first["absolute_path"])
+
+        # k-mesh: the number of k-points, or the delta-k with kpoints = -1
+        use_density = kdensities != None
+        # (only the values finer than the starting ones)
+        if use_density:
+            density = params.raw_params["x_kdensity"]
+            (kdensity, chosen_details, k_steps) = await self._converge_series(
+                run_name,
+                lfilt(kdensities, lambda value: value < density),
+                lambda value: self._set_kmesh(-1, value, kshift, is_so),
+                (density, first),
+                tolerance_eV,
+                params,
+                params_so,
+                params_orb,
+                extra_run_flags,
+            )
+            chosen_mesh = {"kpoints": -1, "x_kdensity": kdensity}
+        else:
+            count = params.raw_params["kpoints"]
+            (kpoint_count, chosen_details, k_steps) = await self._converge_series(
+                run_name,
+                lfilt(kpoints, lambda value: value > count),
+                lambda value: self._set_kmesh(value, None, kshift, is_so),
+                (count, first),
+                tolerance_eV,
+                params,
+                params_so,
+                params_orb,
+                extra_run_flags,
+            )
+            chosen_mesh = {"kpoints": kpoint_count}
+
+        # RKmax at the chosen k-mesh
+        self._set_kmesh(
+            chosen_mesh["kpoints"], chosen_mesh.get("x_kdensity"), kshift, is_so
+        )
+        start_rkmax = params.raw_params["rkmax"]
+        (chosen_rkmax, _, rkmax_steps) = await self._converge_series(
+            run_name,
+            lfilt(rkmax, lambda value: value > start_rkmax),
+            self._set_rkmax,
+            (start_rkmax, chosen_details),
+            tolerance_eV,
+            params,
+            params_so,
+            params_orb,
+            extra_run_flags,
+        )
+
+        # return to the main material directory
+        self.cmd.home()
+        await self.cmd.cd(self.material)
+
+        record = {
+            "material_name": self.material,
+            "run_name": run_name,
+            "date": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+            "tolerance_eV_per_atom": tolerance_eV,
+            "params": {**chosen_mesh, "rkmax": chosen_rkmax},
+            "kmesh_steps": self._series_record(k_steps),
+            "rkmax_steps": self._series_record(rkmax_steps),
+        }
+
+        # keep the record locally for later runs and next to the runs on the server
+        path = MaterialFolder.convergence_path(self.material)
+        with open(path, "w") as f:
+            json.dump(record, f, indent=4)
+        await self.scp.upload(path, path)
+
+        return record
+
+    # ---------------- SHARED INITIALIZATION ----------------
+
+    def _clone_run_directory(self, source, target) -> asyncio.Future:
+        # every file is copied (a later in-place rewrite, e.g. x kgen or sed on an input, must not reach the
+        # other clones), sharing the blocks where the filesystem supports reflinks
+        return self.cmd.type(
+            f"rm -rf {target}; mkdir -p {target} && cp --reflink=auto {source}/* {target}/"
+        )
+
+    def _magnetic_init(self, params: init_lapw_Parameters) -> asyncio.Future:
+        # the moment dependent init steps: the -ask flags, the atomic densities and the starting densities
+        self.cmd.type("instgen_lapw -ask")
+        for flag in self.structure.get_ask_flags(params.text_params["x_ask_flags_pattern"]):
+            self.cmd.type(flag, 0.2)
+
+        self.cmd.type("x lstart")
+        self.cmd.type(params.text_params["calculation_method"])
+        self.cmd.type(params.text_params["separation_energy_eV"])
+
+        is_complex = f"$(test -e {self.material}.in1c && echo -c)"
+        self.cmd.type(f"x dstart {is_complex}")
+        self.cmd.type(f"x dstart -up {is_complex}")
+        return self.cmd.type(f"x dstart -dn {is_complex}")
+
+    async def shared_init_run(
+        self,
+        run_name,
+        configurations,
+        params_so: init_so_lapw_Parameters = None,
+        params_orb: UJ_Parameters = None,
+        extra_run_flags="",
+    ):
+        """Runs several magnetic configurations of the structure ({name: -ask init_lapw_Parameters}, e.g. from
+        init_lapw_Parameters.magnetic_configurations) that differ only in x_ask_flags_pattern.
+        The geometry dependent init (nn, sgroup, symmetry, kgen, ...) runs once per group of configurations
+        with the same symmetry (see StructureFile.group_magnetic_patterns), in the run_name directory
+        (run_name_1, run_name_2, ... for several groups). Every configuration is a clone of its group's init
+        (in its own name directory, as with manual_run) with only instgen_lapw, lstart and dstart redone.
+        Configurations of lower symmetry get their own init: sharing would make every configuration of the group
+        pay for the non-equivalent atoms of the least symmetric one (a 1x1x2 Mn2As goes from 3 to 12).
+        The runs go side by side, returns their {name: run details}."""
+        params = list(configurations.values())[0]
+        shared_params = {
+            k: v for k, v in params.text_params.items() if k != "x_ask_flags_pattern"
+        }
+        for other in configurations.values():
+            if params.text_params["lstart_flag"] != "-ask" or {
+                k: v for k, v in other.text_params.items() if k != "x_ask_flags_pattern"
+            } != shared_params:
+                raise Exception(
+                    "The configurations of a shared init must be -ask runs differing only in x_ask_flags_pattern."
+                )
+
+        # assess the high level location
+        is_sp = params.raw_params["spin_polarized"]
+        is_orb = params_orb != None
+        is_so = params_so != None
+        sp_so_orb_path = f"sp{'1' if is_sp else '0'}_so{'1' if is_so else '0'}_orb{'1' if is_orb else '0'}"
+
+        names = list(configurations.keys())
+        groups = lmap(
+            self.structure.group_magnetic_patterns(
+                [config.raw_params["x_ask_flags_pattern"] for config in configurations.values()]
+            ),
+            lambda group: lmap(group, lambda i: names[i]),
+        )
+
+        # a clone is written over its directory, it must not be one of the shared inits
+        shared_names = (
+            [run_name]
+            if len(groups) == 1
+            else [f"{run_name}_{index + 1}" for index in range(len(groups))]
+        )
+        clashes = [name for name in names if name in shared_names]
+        if len(clashes) > 0:
+            raise Exception(
+                f"The configurations {clashes} would overwrite the shared init, rename them or the run."
+            )
+
+        # the configurations run side by side from this session, each in a scratch of its own
+        scratches = {name: f"{self.session.scratch_path}/{name}" for name in configurations}
+
+        run_dirs = {}
+        shared_dirs = {}
+        group_patterns = {}
+        used_params_so = params_so
+        for index, group in enumerate(groups):
+            # the shared init, atoms are kept apart if their moments differ in any configuration of the group
+            patterns = [configurations[name].raw_params["x_ask_flags_pattern"] for name in group]
+            shared_path = f"{sp_so_orb_path}/{shared_names[index]}/{self.material}"
+            self.cmd.type(f"mkdir -p {shared_path}")
+            await self.cmd.cd(shared_path)
+            used_params_so = await self._initialize(params, params_so, params_orb, patterns)
+            await self._await_console()
+            shared_dir = self.cmd.curr_dir
+            await self.cmd.cd("../../..")
+
+            # clone, redo the moment dependent steps and launch every configuration of the group
+            for name in group:
+                path = f"{sp_so_orb_path}/{name}/{self.material}"
+                await self._clone_run_directory(shared_path, path)
+                await self.cmd.cd(path)
+                await self._magnetic_init(configurations[name])
+                # the launch resets the run files out of band, the clone must not wipe them afterwards
+                await self._await_console()
+                await self._launch_lapw(
+                    is_sp, is_so, is_orb, extra_run_flags, scratches[name]
+                )
+                run_dirs[name] = self.cmd.curr_dir
+                shared_dirs[name] = shared_dir
+                group_patterns[name] = patterns
+                await self.cmd.cd("../../..")
+        params_so = used_params_so
+
+        # the structure holds the moments of all the configurations, each run is identified by its own
+        fingerprints = {}
+        for name, config in configurations.items():
+            structure = self.structure.copy()
+            structure.set_magnetic_moments(config.raw_params["x_ask_flags_pattern"])
+            fingerprints[name] = structure.fingerprint()
+
+        ends = await asyncio.gather(
+            *[self._await_lapw_end(run_dirs[name]) for name in configurations]
+        )
+        await self.session.ensure_console()
+
+        # diagnostics are saved (and not converged runs recovered) from each run directory in turn
+        all_details = {}
+        for (name, config), (runtime, status) in zip(configurations.items(), ends):
+            # the MM_atoms of a run follow the non-equivalent atoms of its group's init
+            self.structure.set_magnetic_moments(group_patterns[name])
+            self.cmd.home()
+            await self.cmd.cd(run_dirs[name])
+            (runtime, status, recovery) = await self._recover_mixing(
+                runtime, status, config, params_so, params_orb, extra_run_flags, scratches[name]
+            )
+            all_details[name] = await self._save_run_diagnostics(
+                name,
+                "run_" + rng_string(16),
+                status,
+                runtime,
+                config,
+                params_so,
+                params_orb,
+                shared_init=shared_dirs[name],
+                recovery=recovery,
+                fingerprint=fingerprints[name],
+            )
+
+        # return to the main material directory
+        self.cmd.home()
+        await self.cmd.cd(self.material)
+        return all_details
 
     # ---------------- PROCESSING ----------------
 
@@ -357,8 +1025,341 @@ class MaterialFolder:
 
     # ---------------- OPTIMISATIONS / AUTOMATIZATIONS ----------------
 
+class Sweep:
+    """Runs a batch of structures of one material side by side, every point in its own MaterialFolder
+    with a pooled session, at most `concurrency` of them at once (the session pool size by default).
+    The runs go to the run directories named "{sweep_name}_{point name}"."""
+
+    def __init__(
+        self,
+        credentials_json_path,
+        material_name,
+        sweep_name,
+        params: init_lapw_Parameters,
+        params_so: init_so_lapw_Parameters = None,
+        params_orb: UJ_Parameters = None,
+        extra_run_flags="",
+        concurrency=None,
+        warm_start=True,
+    ) -> None:
+        self.credentials_path = credentials_json_path
+        self.material = material_name
+        self.sweep_name = sweep_name
+
+        self.params = params
+        self.params_so = params_so
+        self.params_orb = params_orb
+        self.extra_run_flags = extra_run_flags
+
+        self.semaphore = asyncio.Semaphore(
+            SessionPool.size if concurrency == None else concurrency
+        )
+        # points with a coordinate start from the density of the closest finished point
+        self.warm_start = warm_start
+
+        self.results = {}  # point name -> run details (None if the point failed)
+        self.coordinates = {}  # point name -> sweep coordinate
+        self.structures = {}  # point name -> structure
+
+    def _warm_start_source(self, coordinate):
+        finished = [
+            (abs(self.coordinates[name] - coordinate), details["absolute_path"])
+            for name, details in self.results.items()
+            if details != None
+            and details["diagnostics"]["status"] == "success"
+            and self.coordinates.get(name) != None
+        ]
+        return min(finished)[1] if len(finished) > 0 else None
+
+    # run_lapw criteria of the two stages of run_staged (energy in Ry, charge in e)
+    LOOSE_RUN_FLAGS = "-ec 0.001 -cc 0.01"
+    STRICT_RUN_FLAGS = "-ec 0.00001 -cc 0.0001"
+
+    def _run_flags(self, convergence_stage):
+        if convergence_stage == None:
+            return self.extra_run_flags
+        return f"{self.extra_run_flags} {convergence_stage['run_flags']}"
+
+    async def run_point(self, name, structure, coordinate=None, convergence_stage=None):
+        async with self.semaphore:
+            warm_start_from = (
+                self._warm_start_source(coordinate)
+                if self.warm_start and coordinate != None
+                else None
+            )
+
+            mf = MaterialFolder(self.credentials_path, self.material, structure=structure)
+            await mf.open()
+            try:
+                details = await mf.manual_run(
+                    f"{self.sweep_name}_{name}",
+                    self.params,
+                    self.params_so,
+                    self.params_orb,
+                    auto_confirm=True,
+                    extra_run_flags=self._run_flags(convergence_stage),
+                    warm_start_from=warm_start_from,
+                    convergence_stage=convergence_stage,
+                )
+            except Exception as e:
+                # one broken point does not stop the rest of the sweep
+                print(f"Sweep {self.sweep_name}: point {name} failed ({e})")
+                details = None
+            finally:
+                await mf.close()
+
+            self.results[name] = details
+            self.coordinates[name] = coordinate
+            self.structures[name] = structure
+            return details
+
+    async def run(self, structures, coordinates=None, convergence_stage=None):
+        """Runs all the {name: structure} points, returns their {name: run details}.
+        With coordinates ({name: float}) and warm starts, the point closest to their median runs first
+        and the rest follow in waves outward from it (the next point on each side), every wave warm starting
+        from the finished one next to it. Points without a coordinate run with the first wave."""
+        coordinates = {} if coordinates == None else coordinates
+        names = list(structures)
+        placed = [name for name in names if name in coordinates]
+
+        if self.warm_start and len(placed) > 0:
+            middle = np.median([coordinates[name] for name in placed])
+            seed = min(placed, key=lambda name: abs(coordinates[name] - middle))
+            below = sorted(
+                [name for name in placed if coordinates[name] < coordinates[seed]],
+                key=lambda name: -coordinates[name],
+            )
+            above = sorted(
+                [name for name in placed if coordinates[name] >= coordinates[seed] and name != seed],
+                key=lambda name: coordinates[name],
+            )
+            waves = [[seed] + [name for name in names if name not in coordinates]]
+            for index in range(max(len(below), len(above))):
+                waves.append(below[index : index + 1] + above[index : index + 1])
+        else:
+            waves = [names]
+
+        details = {}
+        for wave in waves:
+            wave_details = await asyncio.gather(
+                *[
+                    self.run_point(name, structures[name], coordinates.get(name), convergence_stage)
+                    for name in wave
+                ]
+            )
+            details.update(zip(wave, wave_details))
+        return {name: details[name] for name in names}
+
+    async def _tighten_point(self, name, convergence_stage):
+        async with self.semaphore:
+            loose = self.results[name]
+            mf = MaterialFolder(self.credentials_path, self.material, structure=self.structures[name])
+            await mf.open()
+            try:
+                # continue in the loose run's directory from its density
+                mf.cmd.home()
+                await mf.cmd.cd(loose["absolute_path"])
+                details = await mf._continue_run(
+                    f"{self.sweep_name}_{name}",
+                    self.params,
+                    self.params_so.reinstantiate(self.params) if self.params_so != None else None,
+                    self.params_orb,
+                    self._run_flags(convergence_stage),
+                    convergence_stage=convergence_stage,
+                )
+            except Exception as e:
+                print(f"Sweep {self.sweep_name}: tightening point {name} failed ({e})")
+                details = None
+            finally:
+                await mf.close()
+
+            if details != None:
+                self.results[name] = details
+            return details
+
+    async def run_staged(
+        self,
+        structures,
+        coordinates=None,
+        window_eV=0.1,
+        loose_flags=LOOSE_RUN_FLAGS,
+        strict_flags=STRICT_RUN_FLAGS,
+    ):
+        """Runs all the points with the loose criteria, ranks them by energy per cell and continues only the ones
+        within window_eV of the lowest with the strict criteria, from the loose density.
+        Returns {name: run details}, the strict ones for the tightened points. Both stages are recorded
+        under inputs.convergence_stage of the run details."""
+        loose = await self.run(
+            structures, coordinates, {"stage": "loose", "run_flags": loose_flags}
+        )
+
+        ranking = sorted(
+            [
+                (details["results"]["energy_per_cell_eV"], name)
+                for name, details in loose.items()
+                if details != None and details["diagnostics"]["status"] == "success"
+            ]
+        )
+        if len(ranking) == 0:
+            print(f"Sweep {self.sweep_name}: no point converged in the loose stage.")
+            return loose
+
+        candidates = [
+            (rank, name)
+            for rank, (energy, name) in enumerate(ranking)
+            if energy - ranking[0][0] <= window_eV
+        ]
+        strict = await asyncio.gather(
+            *[
+                self._tighten_point(
+                    name,
+                    {
+                        "stage": "strict",
+                        "run_flags": strict_flags,
+                        "loose_run_flags": loose_flags,
+                        "loose_rank": rank,
+                        "loose_energy_per_cell_eV": loose[name]["results"]["energy_per_cell_eV"],
+                        "loose_cycles": loose[name]["diagnostics"]["cycles"],
+                        "window_eV": window_eV,
+                    },
+                )
+                for rank, name in candidates
+            ]
+        )
+
+        results = dict(loose)
+        for (_, name), details in zip(candidates, strict):
+            if details != None:
+                results[name] = details
+        return results
+
+    def _energies(self, names):
+        # successful points only, energies of the unit cell (not the supercell)
+        names = [
+            name
+            for name in names
+            if self.results.get(name) != None
+            and self.results[name]["diagnostics"]["status"] == "success"
+        ]
+        coordinates = np.array([self.coordinates[name] for name in names])
+        energies = np.array([self.results[name]["results"]["energy_per_cell_eV"] for name in names])
+        order = np.argsort(coordinates)
+        return coordinates[order], energies[order]
+
+    @staticmethod
+    def _refinement(coordinates, energies, best, points):
+        """New coordinates: past the edge if the lowest energy lies on it, else around the fitted best."""
+        if len(coordinates) < 2:
+            raise Exception("Less than 2 points of the sweep succeeded, nothing to refine from.")
+        steps = np.diff(coordinates)
+        lowest = np.argmin(energies)
+        if lowest == 0:
+            return coordinates[0] - steps[0] * np.arange(1, points + 1)
+        if lowest == len(coordinates) - 1:
+            return coordinates[-1] + steps[-1] * np.arange(1, points + 1)
+
+        best = coordinates[lowest] if best == None else best
+        spacing = steps[max(np.searchsorted(coordinates, best) - 1, 0)]
+        return best + spacing / 2 * np.linspace(-1, 1, points)
+
+    async def equation_of_state(
+        self,
+        structure: StructureFile,
+        volume_scales=np.linspace(0.94, 1.06, 7),
+        kind="birch_murnaghan",
+        refinements=1,
+        refinement_points=2,
+    ):
+        """Runs the structure at the scaled volumes, fits the E(V) equation of state (see fit_eos)
+        and adds refinement_points around the fitted minimum (or past the range) for each refinement."""
+        volume = abs(np.linalg.det(structure.get_lattice_matrix(with_multiples=False)))
+        names = []
+        scales = volume_scales
+        for i in range(refinements + 1):
+            # the point names carry the coordinate with 4 decimals
+            scales = np.round(scales, 4)
+            structures = {
+                name: point
+                for name, point in scaled_structures(structure, scales).items()
+                if name not in self.results
+            }
+            await self.run(
+                structures,
+                {name: float(name[1:]) for name in structures},
+            )
+            names += list(structures)
+
+            (scale_values, energies) = self._energies(names)
+            fit = None
+            if len(scale_values) >= 4 and 0 < np.argmin(energies) < len(energies) - 1:
+                fit = fit_eos(scale_values * volume, energies, kind)
+            if i == refinements:
+                break
+
+            best = fit["V0_A3"] / volume if fit != None else None
+            scales = Sweep._refinement(scale_values, energies, best, refinement_points)
+
+        if fit == None:
+            raise Exception(f"Sweep {self.sweep_name}: the energy minimum is not bracketed by the volume points.")
+        fit["points"] = {
+            "volumes_A3": (scale_values * volume).tolist(),
+            "energies_eV": energies.tolist(),
+        }
+        return fit
+
+    async def c_over_a(
+        self,
+        structure: StructureFile,
+        ratios=None,
+        refinements=1,
+        refinement_points=2,
+    ):
+        """Runs the structure at the c/a ratios (by default +-3 % of its own) at constant volume
+        and fits a parabola for the best ratio, refined like equation_of_state."""
+        current = structure.c / structure.a
+        ratios = current * np.linspace(0.97, 1.03, 5) if ratios is None else ratios
+        names = []
+        for i in range(refinements + 1):
+            ratios = np.round(ratios, 4)
+            structures = {
+                name: point
+                for name, point in c_over_a_structures(structure, ratios).items()
+                if name not in self.results
+            }
+            await self.run(
+                structures,
+                {name: float(name[2:]) for name in structures},
+            )
+            names += list(structures)
+
+            (ratio_values, energies) = self._energies(names)
+            best = None
+            if len(ratio_values) >= 3 and 0 < np.argmin(energies) < len(energies) - 1:
+                (best, energy) = fit_parabola_minimum(ratio_values, energies)
+            if i == refinements:
+                break
+
+            ratios = Sweep._refinement(ratio_values, energies, best, refinement_points)
+
+        if best == None:
+            raise Exception(f"Sweep {self.sweep_name}: the energy minimum is not bracketed by the c/a points.")
+        return {
+            "c_over_a": best,
+            "energy_eV": energy,
+            "points": {
+                "c_over_a": ratio_values.tolist(),
+                "energies_eV": energies.tolist(),
+            },
+        }
+
+
 async def wien2k_main(coroutines_to_run=[]):
-    await asyncio.gather(*coroutines_to_run, CMD_input.handler_loop())
+    await asyncio.gather(
+        *coroutines_to_run,
+        CMD_input.handler_loop(),
+        SessionPool.eviction_loop(),
+        SSH_Tunnel.probe_loop(),
+    )
 
 if __name__ == "__main__":
     async def run():
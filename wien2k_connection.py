@@ -1,18 +1,20 @@
 from wien2_helper import *
 
+# the backends are only imported on first use (the GUI ones exist only on Windows)
 # GUI controls
-import win32gui
-from pywinauto.application import Application
-from pywinauto.controls.hwndwrapper import HwndWrapper
+win32gui = lazy_import("win32gui")
+pywinauto_application = lazy_import("pywinauto.application")
+pywinauto_hwndwrapper = lazy_import("pywinauto.controls.hwndwrapper")
 
 # image processing
-from pytesseract import pytesseract
+pytesseract = lazy_import("pytesseract.pytesseract")
+ImageOps = lazy_import("PIL.ImageOps")
 
-# SCP
-from paramiko import SSHClient
-from scp import SCPClient
+# SSH / SFTP
+paramiko = lazy_import("paramiko")
 
-import time, os, re, string, random, json, asyncio, PIL.ImageOps
+import time, timeit, os, io, re, string, random, json, asyncio, threading
+from concurrent.futures import ThreadPoolExecutor
 from queue import PriorityQueue
 
 class CMD_input:
@@ -110,7 +112,7 @@ class CMD_input:
 class CMD_Window:
     def __init__(self):
         # Create the app window instance
-        self.app = Application().start(
+        self.app = pywinauto_application.Application().start(
             r"c:\WINDOWS\System32\cmd.exe /k",
             # r'wt new-tab --profile "wien2k_readable" /k',
             create_new_console=True,
@@ -122,7 +124,7 @@ class CMD_Window:
 
         # get the topmost window - this is later used to send kyestrokes!!
         self.uid = win32gui.GetForegroundWindow()
-        self.handle = HwndWrapper(self.uid)
+        self.handle = pywinauto_hwndwrapper.HwndWrapper(self.uid)
 
         # force the thing to maximize
         time.sleep(0.6)
@@ -147,7 +149,7 @@ class CMD_Window:
             CMD_input(
                 self,
                 "type",
-                wait_after,
+                SCP_Connection.scaled_wait(self.associated_host, wait_after),
                 {
                     "text": text,
                     "wait_after": 0,
@@ -166,11 +168,6 @@ class CMD_Window:
         if do_ENTER:
             self.handle.type_keys("{ENTER}", with_spaces=True)
 
-        # TODO: remove or re-implement this
-        # # add additional timeout for bad connections if the wait_after is not exactly 0
-        # if self.associated_host in SCP_Connection.pings and wait_after != 0:
-        #     wait_after += SCP_Connection.pings[self.associated_host]
-        
         time.sleep(wait_after)
 
         return text
@@ -179,7 +176,12 @@ class CMD_Window:
 
     def read_output(self, line_count, order=-1) -> asyncio.Future:
         return CMD_input.enqueue(
-            CMD_input(self, "read", 1, {"line_count": line_count, "order": order})
+            CMD_input(
+                self,
+                "read",
+                SCP_Connection.scaled_wait(self.associated_host, 1),
+                {"line_count": line_count, "order": order},
+            )
         )
 
     def _read_output(self, line_count, order=-1):
@@ -191,7 +193,7 @@ class CMD_Window:
         w, h = img.size
         img = img.crop((10, 70, w - 10, h - 10))
         #invert img to help tesseract
-        img = PIL.ImageOps.invert(img)
+        img = ImageOps.invert(img)
 
         # analyze
         pytesseract.tesseract_cmd = TESSERACT_PATH
@@ -237,6 +239,208 @@ class CMD_Window:
         return self.type("%{F4}", do_ENTER=False)
 
 
+class SSH_Tunnel:
+    """An in-process two-hop link: the second hop runs over a direct-tcpip channel of the first one.
+    Every SFTP, exec and shell channel to host2 is multiplexed over the single authenticated transport."""
+
+    tunnels = {}  # host key -> SSH_Tunnel
+    tunnels_lock = threading.Lock()
+
+    def __init__(self, cred):
+        self.cred = cred
+        self.key = SSH_Tunnel.host_key(cred)
+
+        self.hop1 = None
+        self.hop2 = None
+        self.lock = threading.RLock()
+
+        # incremented on every (re)connect, channels opened on an older generation are dead
+        self.generation = 0
+
+    @staticmethod
+    def host_key(cred):
+        return f"{cred['username2']}@{cred['host2']}/{cred['username1']}@{cred['host1']}"
+
+    @staticmethod
+    def get(cred):
+        """Gets the connected tunnel for a host, creating it on first use."""
+        key = SSH_Tunnel.host_key(cred)
+
+        with SSH_Tunnel.tunnels_lock:
+            if key not in SSH_Tunnel.tunnels:
+                SSH_Tunnel.tunnels[key] = SSH_Tunnel(cred)
+            tunnel = SSH_Tunnel.tunnels[key]
+
+        tunnel.ensure_connected()
+        return tunnel
+
+    @staticmethod
+    def _new_client(cred):
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        if cred.get("accept_unknown_hosts", False):
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        return client
+
+    def is_active(self):
+        return (
+            self.hop2 != None
+            and self.hop2.get_transport() != None
+            and self.hop2.get_transport().is_active()
+        )
+
+    # ---------------- CONNECTION ----------------
+
+    keepalive_interval = 30  # s
+    reconnect_base_delay = 1  # s, doubled after every failed attempt
+    reconnect_max_delay = 60  # s
+    reconnect_attempts = 12
+
+    @staticmethod
+    def connection_errors():
+        return (paramiko.SSHException, EOFError, OSError)
+
+    @staticmethod
+    def fatal_errors():
+        # no retry fixes wrong credentials or a changed host key (both are SSHExceptions)
+        return (paramiko.AuthenticationException, paramiko.BadHostKeyException)
+
+    def ensure_connected(self):
+        """(Re)connects both hops if the transport is down, backing off exponentially between attempts.
+        Authentication and host key errors are raised at once."""
+        with self.lock:
+            if self.is_active():
+                return
+
+            delay = SSH_Tunnel.reconnect_base_delay
+            for attempt in range(SSH_Tunnel.reconnect_attempts):
+                try:
+                    self._close_clients()
+                    self._connect()
+                    self.generation += 1
+                    return
+                except SSH_Tunnel.fatal_errors():
+                    self._close_clients()
+                    raise
+                except SSH_Tunnel.connection_errors() as e:
+                    print(
+                        f"Connecting to {self.key} failed ({e}), attempt {attempt + 1}, retrying in {delay} s"
+                    )
+                    time.sleep(delay)
+                    delay = min(delay * 2, SSH_Tunnel.reconnect_max_delay)
+
+            raise Exception(f"Could not connect to {self.key}.")
+
+    def retrying(self, func, *args):
+        """Calls func, reconnecting and calling it once more if the link dropped in the meantime."""
+        try:
+            return func(*args)
+        except SSH_Tunnel.connection_errors():
+            if self.is_active():
+                raise
+            self.ensure_connected()
+            return func(*args)
+
+    def _connect(self):
+        cred = self.cred
+
+        # first hop
+        self.hop1 = SSH_Tunnel._new_client(cred)
+        self.hop1.connect(
+            cred["host1"],
+            username=cred["username1"],
+            password=cred["password1"],
+            look_for_keys=False,
+        )
+
+        # the second hop is tunnelled through the first transport, no local port is opened
+        channel = self.hop1.get_transport().open_channel(
+            "direct-tcpip", (cred["host2"], 22), ("127.0.0.1", 0)
+        )
+        self.hop2 = SSH_Tunnel._new_client(cred)
+        self.hop2.connect(
+            cred["host2"],
+            username=cred["username2"],
+            password=cred["password2"],
+            sock=channel,
+            look_for_keys=False,
+        )
+
+        # keep both hops alive through idle periods of long runs
+        self.hop1.get_transport().set_keepalive(SSH_Tunnel.keepalive_interval)
+        self.hop2.get_transport().set_keepalive(SSH_Tunnel.keepalive_interval)
+
+    def transport(self):
+        self.ensure_connected()
+        return self.hop2.get_transport()
+
+    def open_sftp(self):
+        self.ensure_connected()
+        return self.hop2.open_sftp()
+
+    def open_session(self):
+        """Opens a new exec/shell channel on the second hop."""
+        return self.transport().open_session()
+
+    def exec(self, command, timeout=None):
+        """Runs a non-interactive command on the second hop, returns (exit code, stdout, stderr)."""
+        self.ensure_connected()
+        stdin, stdout, stderr = self.hop2.exec_command(command, timeout=timeout)
+        stdin.close()
+
+        out = stdout.read().decode(errors="replace")
+        err = stderr.read().decode(errors="replace")
+        return (stdout.channel.recv_exit_status(), out, err)
+
+    # ---------------- LINK PROBING ----------------
+
+    probe_timeout = 30  # s between two probes of a tunnel
+
+    def measure_rtt(self):
+        """Round trip of a keepalive global request over the live transport (s)."""
+        transport = self.transport()
+        start = timeit.default_timer()
+        transport.global_request("keepalive@openssh.com", wait=True)
+        return timeit.default_timer() - start
+
+    def probe(self):
+        SCP_Connection.record_ping(self.cred["host1"], self.measure_rtt())
+
+    @staticmethod
+    async def probe_loop():
+        while True:
+            for tunnel in list(SSH_Tunnel.tunnels.values()):
+                if not tunnel.is_active():
+                    continue
+
+                try:
+                    await SCP_Connection.offload(tunnel.probe)
+                except Exception as e:
+                    print(f"Error while probing {tunnel.key}: {e}")
+
+            await asyncio.sleep(SSH_Tunnel.probe_timeout)
+
+    def _close_clients(self):
+        # the caller holds the lock
+        if self.hop2 != None:
+            self.hop2.close()
+        if self.hop1 != None:
+            self.hop1.close()
+        self.hop1 = None
+        self.hop2 = None
+
+    def close(self):
+        with self.lock:
+            self._close_clients()
+
+    @staticmethod
+    def close_all():
+        with SSH_Tunnel.tunnels_lock:
+            for tunnel in SSH_Tunnel.tunnels.values():
+                tunnel.close()
+            SSH_Tunnel.tunnels = {}
+
+
 class SCP_Connection:
     def __init__(self, cmd: CMD_Window, credentials_json_path: string):
         self.cmd = cmd
@@ -246,112 +450,85 @@ class SCP_Connection:
         with open(self.credentials_path) as json_reader:
             self.credentials = json.load(json_reader)
 
-    ports = {}
     pings = {}  # baseline s
-    ping_growth = {}  # s per byte
-    windows = {}
+
+    # ---------------- ADAPTIVE TIMEOUTS ----------------
+
+    ping_smoothing = 0.3  # weight of a new sample in the moving averages
+    reference_ping = 0.1  # s, the round trip the hard-coded waits were tuned on
+    min_wait_scale = 0.25
+    max_wait_scale = 4.0
 
     @staticmethod
-    def get_host_twohop_port(cred, ping_count=4):
-        """Gets the port number designated to a specific host"""
-
-        # if there is no port assigned to this host, we have to create a new server proxy
-        if not cred["host1"] in SCP_Connection.ports:
-            # choose a random port from a range that has not been chosen yet
-            # TODO: fix "unknown host problem on ports other than 2222"
-            port = 2222
-            while port in SCP_Connection.ports.values():
-                port = random.randint(2222, 9999)
-
-            # save the port so that it's know that this proxy is already running
-            SCP_Connection.ports[cred["host1"]] = port
-
-            # create a new cmd window and run the proxy using it
-            # connects to ssh and at the same time creates a proxy server on localhost that poinst to this, so that the SCP command can be used on two-hop ssh connections
-            cmd_win = CMD_Window()
-
-            # assess ssh speed
-            # small payloads
-            cmd_win._type(f"ping {cred['host1']} -l 32 -n {ping_count}")
-            time.sleep(ping_count)
-            times1 = lmap(
-                lfilt(
-                    lmap(
-                        cmd_win._read_output(6 + ping_count),
-                        lambda l: re.findall(r"time=(\d+)ms", l),
-                    ),
-                    lambda a: len(a) != 0,
-                ),
-                lambda val: float(val[0]) / 1000,
-            )
-            SCP_Connection.pings[cred["host1"]] = max(times1)
-
-            # large payloads
-            cmd_win._type(f"ping {cred['host1']} -l 1024 -n {ping_count}")
-            time.sleep(ping_count)
-            times2 = lmap(
-                lfilt(
-                    lmap(
-                        cmd_win._read_output(6 + ping_count),
-                        lambda l: re.findall(r"time=(\d+)ms", l),
-                    ),
-                    lambda a: len(a) != 0,
-                ),
-                lambda val: float(val[0]) / 1000,
-            )
-            SCP_Connection.ping_growth[cred["host1"]] = abs(
-                sum(times2) / len(times2) - sum(times1) / len(times1)
-            ) / (1024 - 32)
-
-            # create the proxy
-            cmd_win._type(
-                f"ssh {cred['username1']}@{cred['host1']} -L {port}:{cred['host2']}:22",
-                1,
-            )
-            cmd_win._type(
-                f"{cred['password1']}",
-                0.5,
+    def _moving_average(averages, host, sample):
+        if host in averages:
+            sample = (
+                SCP_Connection.ping_smoothing * sample
+                + (1 - SCP_Connection.ping_smoothing) * averages[host]
             )
+        averages[host] = sample
 
-            cmd_win.handle.minimize()
-            SCP_Connection.windows[cred["host1"]] = cmd_win
+    @staticmethod
+    def record_ping(host, rtt):
+        SCP_Connection._moving_average(SCP_Connection.pings, host, rtt)
 
-        # return the port of the running proxy
-        return SCP_Connection.ports[cred["host1"]]
+    @staticmethod
+    def scaled_wait(host, base_wait, latency_bound=False):
+        """Adapts a wait tuned for the reference round trip to the measured link of a host, shorter on faster links
+        and longer on slower ones, never below min_wait_scale (nor above max_wait_scale) of the base wait.
+        Latency bound waits (e.g. polling intervals) scale with the round trip. The others also cover remote work
+        (prompts, logins), only the reference round trip in them is swapped for the measured one, so a fast link
+        cannot cut into the time the remote side needs. Hosts that were not measured yet keep the base wait."""
+        if base_wait == 0 or host not in SCP_Connection.pings:
+            return base_wait
+
+        ping = SCP_Connection.pings[host]
+        if latency_bound:
+            wait = base_wait * ping / SCP_Connection.reference_ping
+        else:
+            wait = base_wait + ping - SCP_Connection.reference_ping
+
+        return sorted(
+            [
+                base_wait * SCP_Connection.min_wait_scale,
+                wait,
+                base_wait * SCP_Connection.max_wait_scale,
+            ]
+        )[1]
 
     def connect_twohop(self):
         # get the ssh credentials
         cred = self.credentials["ssh"]
 
-        # make sure that there is a proxy tow-hop server running
-        port = SCP_Connection.get_host_twohop_port(cred)
+        # share the host's tunnel and open an own SFTP channel over it
+        self.tunnel = SSH_Tunnel.get(cred)
+        self._open_sftp()
 
-        # create ssh connection
-        self.ssh_client = SSHClient()
-        self.ssh_client.load_system_host_keys()
-        # connect it
-        self.ssh_client.connect(
-            "localhost",
-            username=cred["username2"],
-            port=str(port),
-            password=cred["password2"],
-            look_for_keys=False,
-        )
+    def _open_sftp(self):
+        self.sftp_client = self.tunnel.open_sftp()
+        self.sftp_generation = self.tunnel.generation
 
-        # create a scp client
-        self.scp_client = SCPClient(self.ssh_client.get_transport())
+    def sftp(self):
+        """The SFTP channel, reopened if the tunnel reconnected since it was opened."""
+        self.tunnel.ensure_connected()
+        if self.sftp_generation != self.tunnel.generation:
+            self._open_sftp()
+        return self.sftp_client
 
     def disconnect(self):
-        # close the secondary ssh connection
-        self.ssh_client.close()
+        # close only this SFTP channel, the tunnel stays up for the other connections
+        self.sftp_client.close()
 
-    # ---------------- INPUT ----------------
+    # ---------------- PATHS ----------------
 
-    def upload_file(self, src_filepath, destination_filename):
-        """Copies a local file saves the copy in the current server directory.
-        If the uploaded file already exists, it's contents will be overwritten."""
+    def remote_path(self, filename, directory=None):
+        """Path of a file in the given (by default the current) server directory."""
+        directory = self.cmd.curr_dir if directory == None else directory
+        return os.path.join(directory, filename).replace("\\", "/")
 
-        # first create a temporary copy of this file with LF endings and send that
+    # ---------------- INPUT ----------------
+
+    def _put(self, src_filepath, remote_path):
         with open(src_filepath, "rb") as open_file:
             content = open_file.read()
 
@@ -359,48 +536,99 @@ class SCP_Connection:
         # Windows ➡ Unix
         content = content.replace(WINDOWS_LINE_ENDING, UNIX_LINE_ENDING)
 
-        tmp_path = f"LF_tmp_{rng_string(32)}"
-        with open(tmp_path, "wb") as open_file:
-            open_file.write(content)
-
-        # send the LF compatible copy
-        self.scp_client.put(
-            tmp_path,
-            os.path.join(self.cmd.curr_dir, destination_filename).replace("\\", "/"),
+        # send the LF compatible copy straight from memory
+        self.tunnel.retrying(
+            lambda: self.sftp().putfo(io.BytesIO(content), remote_path)
         )
-        time.sleep(0.2)
 
-        # remove the temp file
-        os.remove(tmp_path)
-
-    # ---------------- OUTPUT ----------------
+    def upload_file(self, src_filepath, destination_filename):
+        """Copies a local file saves the copy in the current server directory.
+        If the uploaded file already exists, it's contents will be overwritten."""
+        self._put(src_filepath, self.remote_path(destination_filename))
 
-    def download_file(self, src_filename, receive_filepath):
-        """Copies a file that is in the current server directory and saves it locally.
-        If the local file already exists, it's contents will be overwritten."""
+    async def upload(self, src_filepath, destination_filename):
+        """Awaitable upload_file, the transfer runs in the transfer thread pool."""
+        # resolve the path now, the console may move before the transfer starts
+        remote_path = self.remote_path(destination_filename)
+        return await SCP_Connection.offload(self._put, src_filepath, remote_path)
 
-        tmp_path = f"LF_tmp_{rng_string(32)}"
+    # ---------------- OUTPUT ----------------
 
+    def _get(self, remote_path, receive_filepath):
         # first copy the file from the server with LF endings
-        self.scp_client.get(
-            os.path.join(self.cmd.curr_dir, src_filename).replace("\\", "/"),
-            tmp_path,
-        )
+        buffer = io.BytesIO()
 
-        # open the temporary file
-        with open(tmp_path, "rb") as open_file:
-            content = open_file.read()
+        def get():
+            buffer.seek(0)
+            buffer.truncate()
+            self.sftp().getfo(remote_path, buffer)
+
+        self.tunnel.retrying(get)
+        content = buffer.getvalue()
 
         # replace line endings
-        # Windows ➡ Unix
+        # Unix ➡ Windows
         content = content.replace(UNIX_LINE_ENDING, WINDOWS_LINE_ENDING)
 
         # save the CRLF content
         with open(receive_filepath, "wb") as open_file:
             open_file.write(content)
 
-        # remove the temp file
-        os.remove(tmp_path)
+    def download_file(self, src_filename, receive_filepath):
+        """Copies a file that is in the current server directory and saves it locally.
+        If the local file already exists, it's contents will be overwritten."""
+        self._get(self.remote_path(src_filename), receive_filepath)
+
+    async def download(self, src_filename, receive_filepath):
+        """Awaitable download_file, the transfer runs in the transfer thread pool."""
+        remote_path = self.remote_path(src_filename)
+        return await SCP_Connection.offload(self._get, remote_path, receive_filepath)
+
+    # ---------------- COMMANDS ----------------
+
+    def _in_directory(self, command, directory):
+        directory = self.cmd.curr_dir if directory == None else directory
+        return f"cd {directory} && {command}"
+
+    async def exec(self, command, directory=None, timeout=None):
+        """Runs a non-interactive command (in the current server directory by default).
+        Returns (exit code, stdout, stderr)."""
+        return await SCP_Connection.offload(
+            self.tunnel.exec, self._in_directory(command, directory), timeout
+        )
+
+    async def stream(self, command, directory=None):
+        """Runs a non-interactive command and yields its output line by line as it arrives."""
+        channel = await SCP_Connection.offload(
+            self.tunnel.retrying, self.tunnel.open_session
+        )
+        await SCP_Connection.offload(
+            channel.exec_command, self._in_directory(command, directory)
+        )
+        stdout = channel.makefile("r")
+
+        try:
+            while True:
+                line = await SCP_Connection.offload(stdout.readline)
+                if line == "":
+                    break
+                yield line.rstrip("\n")
+        finally:
+            channel.close()
+
+    # ---------------- THREAD POOL ----------------
+
+    transfer_workers = 8
+    executor = ThreadPoolExecutor(
+        max_workers=transfer_workers, thread_name_prefix="wien2k_transfer"
+    )
+
+    @staticmethod
+    async def offload(func, *args):
+        """Runs a blocking paramiko call in the bounded transfer pool without blocking the event loop."""
+        return await asyncio.get_event_loop().run_in_executor(
+            SCP_Connection.executor, func, *args
+        )
 
 
 class dSSH_Connection:
@@ -430,3 +658,158 @@ class dSSH_Connection:
     def disconnect(self) -> asyncio.Future:
         self.cmd.type("exit", 1)
         return self.cmd.type("exit", 1)
+
+
+class Session:
+    """A logged-in console on the second hop together with its SCP link and its own wien2k scratch folder."""
+
+    scratch_basepath = "/home/sedlacek/"
+
+    def __init__(self, credentials_json_path: string, host_key: string):
+        self.credentials_path = credentials_json_path
+        self.host_key = host_key
+
+        self.cmd = None
+        self.scp = None
+        self.ssh = None
+
+        self.scratch_path = ""
+        self.last_used = time.time()
+
+    async def open(self):
+        # connect to the server
+        self.cmd = CMD_Window()
+        self.scp = SCP_Connection(self.cmd, self.credentials_path)
+        # the tunnel may back off for minutes while reconnecting, keep that off the event loop
+        await SCP_Connection.offload(self.scp.connect_twohop)
+        self.ssh = dSSH_Connection(self.cmd, self.credentials_path)
+        self.ssh.connect()
+
+        # create the wien2k scratch used by every run done through this session
+        self.scratch_path = Session.scratch_basepath + f"WS_{rng_string(16)}"
+        self.cmd.type(f"mkdir {self.scratch_path}")
+        self.cmd.type(f"export SCRATCH={self.scratch_path}")
+        return await self.cmd.type(f"export EDITOR=nano")
+
+    # console messages printed when its ssh session drops
+    DISCONNECT_MESSAGES = ["closed by remote host", "connection reset", "broken pipe"]
+
+    async def ensure_console(self):
+        """Logs the console back in if its ssh session dropped and returns it to the directory it was in."""
+        lines = "\n".join(await self.cmd.read_output(5)).lower()
+        if not any(
+            lmap(Session.DISCONNECT_MESSAGES, lambda m: does_text_contain(m, lines, 85))
+        ):
+            return False
+
+        print(f"The console of {self.host_key} was disconnected, logging back in.")
+        self.ssh.connect()
+        self.cmd.type(f"export SCRATCH={self.scratch_path}")
+        self.cmd.type(f"export EDITOR=nano")
+        await self.cmd.type(f"cd {self.cmd.curr_dir}")
+        return True
+
+    def reset(self) -> asyncio.Future:
+        # empty the scratch and go back home, so the next borrower starts clean
+        self.cmd.type(f"rm {self.scratch_path}/* -rf")
+        return self.cmd.home()
+
+    async def close(self):
+        self.cmd.home()
+        self.cmd.type(f"rm {self.scratch_path} -rf")
+
+        self.ssh.disconnect()
+        self.scp.disconnect()
+
+        return await self.cmd.kill()
+
+
+class SessionPool:
+    """Keeps logged-in sessions warm for each host, so that opening a MaterialFolder only borrows one."""
+
+    size = 4  # number of idle sessions kept per host
+    idle_timeout = 15 * 60  # s, idle sessions older than this are closed
+    eviction_checking_timeout = 30  # s
+
+    idle = {}  # host key -> list of idle sessions
+    busy = {}  # host key -> number of borrowed sessions
+
+    @staticmethod
+    def host_key(credentials_json_path):
+        with open(credentials_json_path) as json_reader:
+            cred = json.load(json_reader)["ssh"]
+
+        return SSH_Tunnel.host_key(cred)
+
+    @staticmethod
+    async def _new_session(credentials_json_path, key) -> Session:
+        session = Session(credentials_json_path, key)
+        await session.open()
+        return session
+
+    @staticmethod
+    async def acquire(credentials_json_path) -> Session:
+        key = SessionPool.host_key(credentials_json_path)
+        idle = SessionPool.idle.setdefault(key, [])
+
+        # prefer the most recently used session, the oldest ones are left to expire
+        if len(idle) > 0:
+            session = idle.pop()
+        else:
+            session = await SessionPool._new_session(credentials_json_path, key)
+
+        SessionPool.busy[key] = SessionPool.busy.get(key, 0) + 1
+        return session
+
+    @staticmethod
+    async def release(session: Session):
+        key = session.host_key
+        SessionPool.busy[key] = max(SessionPool.busy.get(key, 0) - 1, 0)
+
+        await session.ensure_console()
+        await session.reset()
+        session.last_used = time.time()
+
+        idle = SessionPool.idle.setdefault(key, [])
+        if len(idle) < SessionPool.size:
+            idle.append(session)
+        else:
+            await session.close()
+
+    @staticmethod
+    async def prewarm(credentials_json_path, count=None):
+        """Logs in sessions ahead of time until `count` (by default the pool size) of them are idle."""
+        key = SessionPool.host_key(credentials_json_path)
+        idle = SessionPool.idle.setdefault(key, [])
+        count = SessionPool.size if count == None else count
+
+        while len(idle) < count:
+            idle.append(await SessionPool._new_session(credentials_json_path, key))
+
+    @staticmethod
+    async def evict_idle(max_idle_time=None):
+        max_idle_time = SessionPool.idle_timeout if max_idle_time == None else max_idle_time
+        now = time.time()
+
+        # (acquire may add hosts while the sessions are closing)
+        for key in list(SessionPool.idle):
+            expired = lfilt(
+                SessionPool.idle[key], lambda s: now - s.last_used > max_idle_time
+            )
+            SessionPool.idle[key] = lfilt(
+                SessionPool.idle[key], lambda s: s not in expired
+            )
+
+            for session in expired:
+                await session.close()
+
+    @staticmethod
+    async def close_all():
+        await SessionPool.evict_idle(-1)
+        SSH_Tunnel.close_all()
+
+    @staticmethod
+    async def eviction_loop():
+        while True:
+            await asyncio.sleep(SessionPool.eviction_checking_timeout)
+            await SessionPool.evict_idle()
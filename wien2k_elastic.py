@@ -0,0 +1,92 @@
+from wien2_helper import *
+
+import numpy as np
+import itertools
+
+# Voigt index of every (i,j) strain/stress tensor component
+VOIGT_PAIRS = [(0, 0), (1, 1), (2, 2), (1, 2), (0, 2), (0, 1)]
+UPPER_TRIANGLE = [(i, j) for i in range(6) for j in range(i, 6)]
+
+
+def voigt_to_tensor(voigt):
+    """(K,6) Voigt strains (engineering shears) to (K,3,3) symmetric tensors."""
+    voigt = np.asarray(voigt, dtype=float).reshape(-1, 6)
+    tensors = np.zeros((len(voigt), 3, 3))
+    for index, (i, j) in enumerate(VOIGT_PAIRS):
+        value = voigt[:, index] if i == j else voigt[:, index] / 2
+        tensors[:, i, j] = value
+        tensors[:, j, i] = value
+    return tensors
+
+
+def lagrangian_voigt(strains):
+    """(K,6) Voigt form of the Lagrangian strains 1/2 (F^T F - I) of the deformations F = I + strain."""
+    deformations = np.eye(3) + np.asarray(strains, dtype=float).reshape(-1, 3, 3)
+    lagrangian = 0.5 * (np.einsum("kji,kjl->kil", deformations, deformations) - np.eye(3))
+    return np.stack(
+        [lagrangian[:, i, j] * (1 if i == j else 2) for i, j in VOIGT_PAIRS], axis=1
+    )
+
+
+class ElasticSet:
+    """Strained copies of a structure for an energy-strain fit of the elastic constants.
+    The strains are every Voigt component alone and every pair of them at each magnitude, which fixes all 21 Cij.
+    Strained cells that are the same crystal (by fingerprint) are run only once."""
+
+    DEFAULT_MAGNITUDES = (-0.01, -0.005, 0.005, 0.01)
+
+    def __init__(self, structure, magnitudes=None, strains=None):
+        self.structure = structure
+
+        if strains == None:
+            magnitudes = magnitudes if magnitudes != None else ElasticSet.DEFAULT_MAGNITUDES
+            patterns = np.array(
+                [np.eye(6)[i] for i in range(6)]
+                + [np.eye(6)[i] + np.eye(6)[j] for i, j in itertools.combinations(range(6), 2)]
+            )
+            strains = voigt_to_tensor(
+                (np.asarray(magnitudes)[:, None, None] * patterns[None, :, :]).reshape(-1, 6)
+            )
+        self.strains = np.asarray(strains, dtype=float).reshape(-1, 3, 3)
+
+        # name of the run of every strain, strains that give the same crystal share it
+        self.run_names = []
+        self.runs = {}
+        for index, strained in enumerate(self.structure.generate_strained(self.strains)):
+            fingerprint = strained.fingerprint()
+            if fingerprint not in self.runs:
+                name = f"strain_{len(self.runs)}"
+                self.runs[fingerprint] = (name, strained)
+            self.run_names.append(self.runs[fingerprint][0])
+
+    def structures(self):
+        """{run name: strained structure} of the symmetry-distinct strains."""
+        return {name: structure for name, structure in self.runs.values()}
+
+    @staticmethod
+    def _energy(result):
+        # total energies straight away or the run details saved by MaterialFolder
+        if isinstance(result, dict):
+            return result["results"]["energy_tot_eV"]
+        return float(result)
+
+    def fit(self, results):
+        """Elastic constants (6,6) in GPa from {run name: total energy in eV (or run details)} of the runs.
+        Fits E / V0 = E0 / V0 + stress . eta + 1/2 eta . C . eta over the Lagrangian strains eta in one least squares."""
+        energies = np.array(lmap(self.run_names, lambda name: ElasticSet._energy(results[name])))
+        volume = abs(np.linalg.det(self.structure.get_lattice_matrix()))
+        eta = lagrangian_voigt(self.strains)
+
+        quadratic = np.stack(
+            [eta[:, i] * eta[:, j] * (0.5 if i == j else 1.0) for i, j in UPPER_TRIANGLE],
+            axis=1,
+        )
+        design = np.hstack([np.ones((len(eta), 1)), eta, quadratic])
+        coefficients, _, rank, _ = np.linalg.lstsq(design, energies / volume, rcond=None)
+        if rank < design.shape[1]:
+            print(f"Elastic fit is underdetermined (rank {rank} of {design.shape[1]}), add strains.")
+
+        C = np.zeros((6, 6))
+        for (i, j), value in zip(UPPER_TRIANGLE, coefficients[7:]):
+            C[i, j] = C[j, i] = value
+        return C * Constants.eV_per_A3_to_GPa
@@ -0,0 +1,80 @@
+import numpy as np
+from collections import namedtuple
+from types import MappingProxyType
+
+# chemical symbols indexed by the atomic number (index 0 is a placeholder)
+ELEMENT_SYMBOLS = (
+    "",
+    "H", "He",
+    "Li", "Be", "B", "C", "N", "O", "F", "Ne",
+    "Na", "Mg", "Al", "Si", "P", "S", "Cl", "Ar",
+    "K", "Ca", "Sc", "Ti", "V", "Cr", "Mn", "Fe", "Co", "Ni", "Cu", "Zn", "Ga", "Ge", "As", "Se", "Br", "Kr",
+    "Rb", "Sr", "Y", "Zr", "Nb", "Mo", "Tc", "Ru", "Rh", "Pd", "Ag", "Cd", "In", "Sn", "Sb", "Te", "I", "Xe",
+    "Cs", "Ba", "La", "Ce", "Pr", "Nd", "Pm", "Sm", "Eu", "Gd", "Tb", "Dy", "Ho", "Er", "Tm", "Yb", "Lu",
+    "Hf", "Ta", "W", "Re", "Os", "Ir", "Pt", "Au", "Hg", "Tl", "Pb", "Bi", "Po", "At", "Rn",
+    "Fr", "Ra", "Ac", "Th", "Pa", "U", "Np", "Pu", "Am", "Cm", "Bk", "Cf", "Es", "Fm", "Md", "No", "Lr",
+    "Rf", "Db", "Sg", "Bh", "Hs", "Mt", "Ds", "Rg", "Cn", "Nh", "Fl", "Mc", "Lv", "Ts", "Og",
+)
+
+_SYMBOLS_ARRAY = np.asarray(ELEMENT_SYMBOLS, dtype=object)
+_ATOMIC_NUMBERS = MappingProxyType(
+    {ELEMENT_SYMBOLS[Z]: Z for Z in range(1, len(ELEMENT_SYMBOLS))}
+)
+
+
+def element_symbol(Z):
+    Z = int(Z)
+    if Z < 1 or Z >= len(ELEMENT_SYMBOLS):
+        raise Exception(f"Invalid atomic number {Z}.")
+    return ELEMENT_SYMBOLS[Z]
+
+
+def element_symbols(numbers):
+    """Symbols of a whole array of atomic numbers at once."""
+    return _SYMBOLS_ARRAY[np.asarray(numbers, dtype=int)]
+
+
+def atomic_number(symbol):
+    symbol = str(symbol).strip().capitalize()
+    if symbol not in _ATOMIC_NUMBERS:
+        raise Exception(f"Unknown element symbol '{symbol}'.")
+    return _ATOMIC_NUMBERS[symbol]
+
+
+# --------------- ELEMENT PROPERTIES ---------------
+
+# covalent radius in angstroms, NaN where unknown
+ElementProperties = namedtuple(
+    "ElementProperties",
+    ["Z", "symbol", "name", "atomic_weight", "covalent_radius", "electronegativity"],
+)
+
+_element_properties = None
+
+
+def element_properties(Z=None):
+    """Immutable Z -> ElementProperties table (or a single entry).
+    It is read from mendeleev's database in one query on first use and reused afterwards."""
+    global _element_properties
+
+    if _element_properties == None:
+        from mendeleev.fetch import fetch_table
+
+        table = fetch_table("elements")
+        _element_properties = MappingProxyType(
+            {
+                int(row.atomic_number): ElementProperties(
+                    int(row.atomic_number),
+                    row.symbol,
+                    row.name,
+                    float(row.atomic_weight),
+                    float(row.covalent_radius_pyykko) / 100,  # pm -> angstrom
+                    float(row.en_pauling),
+                )
+                for row in table.itertuples()
+            }
+        )
+
+    if Z == None:
+        return _element_properties
+    return _element_properties[int(Z)]
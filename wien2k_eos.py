@@ -0,0 +1,111 @@
+from wien2_helper import *
+
+import numpy as np
+
+
+def birch_murnaghan(volumes, E0, V0, B0, B1):
+    """Third order Birch-Murnaghan energies (E in eV, V in angstrom^3, B0 in eV/angstrom^3)."""
+    eta = (V0 / np.asarray(volumes)) ** (2.0 / 3.0)
+    return E0 + 9.0 * V0 * B0 / 16.0 * ((eta - 1.0) ** 3 * B1 + (eta - 1.0) ** 2 * (6.0 - 4.0 * eta))
+
+
+def vinet(volumes, E0, V0, B0, B1):
+    """Vinet energies (E in eV, V in angstrom^3, B0 in eV/angstrom^3)."""
+    x = (np.asarray(volumes) / V0) ** (1.0 / 3.0)
+    xi = 1.5 * (B1 - 1.0)
+    return E0 + 9.0 * B0 * V0 / xi**2 * (1.0 + (xi * (1.0 - x) - 1.0) * np.exp(xi * (1.0 - x)))
+
+
+EOS_FORMS = {
+    "birch_murnaghan": birch_murnaghan,
+    "vinet": vinet,
+}
+
+
+def fit_eos(volumes, energies, kind="birch_murnaghan", iterations=50):
+    """Fits an equation of state to E(V) points (eV, angstrom^3).
+    The start comes from the linear least squares of E in powers of V^-2/3 (exact for Birch-Murnaghan),
+    refined by Gauss-Newton steps of the chosen form. Returns E0 (eV), V0 (angstrom^3), B0 (GPa), B1 and the rms residual."""
+    volumes = np.asarray(volumes, dtype=float)
+    energies = np.asarray(energies, dtype=float)
+    form = EOS_FORMS[kind]
+    if len(volumes) < 4:
+        raise Exception(f"At least 4 points are needed for an equation of state fit ({len(volumes)} given).")
+
+    # E = c0 + c1 x + c2 x^2 + c3 x^3 with x = V^-2/3
+    x = volumes ** (-2.0 / 3.0)
+    coefficients = np.linalg.lstsq(np.vander(x, 4, increasing=True), energies, rcond=None)[0]
+    roots = np.roots([3 * coefficients[3], 2 * coefficients[2], coefficients[1]])
+    curvatures = lmap(roots, lambda r: 2 * coefficients[2] + 6 * coefficients[3] * r)
+    minima = [
+        root.real
+        for root, curvature in zip(roots, curvatures)
+        if abs(root.imag) < 1e-12 and root.real > 0 and curvature.real > 0
+    ]
+    if len(minima) == 0:
+        raise Exception("The energies have no minimum, extend the volume range.")
+    x0 = min(minima, key=lambda r: abs(r - x.mean()))
+    V0 = x0 ** (-1.5)
+    B0 = V0 * (2 * coefficients[2] + 6 * coefficients[3] * x0) * (2.0 / 3.0 * V0 ** (-5.0 / 3.0)) ** 2
+    parameters = np.array([np.polyval(coefficients[::-1], x0), V0, B0, 4.0])
+
+    # Gauss-Newton with a central difference jacobian of all the parameters at once
+    for i in range(iterations):
+        residuals = energies - form(volumes, *parameters)
+        steps = np.maximum(np.abs(parameters), 1e-3) * 1e-6
+        jacobian = np.stack(
+            [
+                (form(volumes, *(parameters + np.eye(4)[k] * steps[k])) - form(volumes, *(parameters - np.eye(4)[k] * steps[k]))) / (2 * steps[k])
+                for k in range(4)
+            ],
+            axis=1,
+        )
+        update = np.linalg.lstsq(jacobian, residuals, rcond=None)[0]
+        parameters = parameters + update
+        if np.all(np.abs(update) <= 1e-10 * np.maximum(np.abs(parameters), 1.0)):
+            break
+
+    residuals = energies - form(volumes, *parameters)
+    return {
+        "kind": kind,
+        "E0_eV": float(parameters[0]),
+        "V0_A3": float(parameters[1]),
+        "B0_GPa": float(parameters[2] * Constants.eV_per_A3_to_GPa),
+        "B1": float(parameters[3]),
+        "rms_eV": float(np.sqrt(np.mean(residuals**2))),
+    }
+
+
+def fit_parabola_minimum(values, energies):
+    """Minimum (value, energy) of a parabola fitted to E(value) points, e.g. for c/a."""
+    c2, c1, c0 = np.polyfit(values, energies, 2)
+    if c2 <= 0:
+        raise Exception("The energies have no minimum, extend the range.")
+    best = -c1 / (2 * c2)
+    return float(best), float(np.polyval([c2, c1, c0], best))
+
+
+def scaled_structures(structure, volume_scales):
+    """{name: copy of the structure} with its volume scaled by each factor (fractional positions kept)."""
+    structures = {}
+    for scale in volume_scales:
+        scaled = structure.copy()
+        factor = scale ** (1.0 / 3.0)
+        scaled.a, scaled.b, scaled.c = structure.a * factor, structure.b * factor, structure.c * factor
+        scaled.add_tweak_message(f"Volume scale : {scale:.6f}")
+        structures[f"V{scale:.4f}"] = scaled
+    return structures
+
+
+def c_over_a_structures(structure, ratios):
+    """{name: copy of the structure} with each c/a ratio at the same volume (a = b scaled together)."""
+    structures = {}
+    current = structure.c / structure.a
+    for ratio in ratios:
+        varied = structure.copy()
+        factor = (current / ratio) ** (1.0 / 3.0)
+        varied.a, varied.b = structure.a * factor, structure.b * factor
+        varied.c = varied.a * ratio
+        varied.add_tweak_message(f"c/a : {current:.6f} -> {ratio:.6f}")
+        structures[f"ca{ratio:.4f}"] = varied
+    return structures
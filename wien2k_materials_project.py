@@ -0,0 +1,109 @@
+from wien2_helper import *
+
+import os, re, json, time
+
+# optional dependency, imported on first use
+mp_api_client = lazy_import("mp_api.client")
+
+
+class MaterialsProjectCache:
+    """Local cache of Materials Project structures, one json file per material id.
+    Records older than the ttl (seconds) or of another cache version are fetched again."""
+
+    CACHE_VERSION = 1
+    DEFAULT_DIRECTORY = "mp_cache"
+    DEFAULT_TTL = 30 * 24 * 3600
+
+    FIELDS = ["material_id", "formula_pretty", "structure"]
+
+    def __init__(self, directory=None, ttl=None, client=None):
+        self.directory = directory if directory != None else MaterialsProjectCache.DEFAULT_DIRECTORY
+        self.ttl = ttl if ttl != None else MaterialsProjectCache.DEFAULT_TTL
+
+        # anything with summary.search(material_ids=..., fields=...) (e.g. an open MPRester or a stub),
+        # a new MPRester is opened per fetch if None
+        self.client = client
+
+    @staticmethod
+    def material_id(url):
+        """The mp-... id from a Materials Project url (or the id itself)."""
+        ids = re.findall(r"mp-\d+", url)
+        if len(ids) == 0:
+            raise Exception(f"No Materials Project id in: {url}")
+        return ids[0]
+
+    def path(self, mp_id):
+        return os.path.join(self.directory, f"{mp_id}.json")
+
+    def read(self, mp_id):
+        """The cached record of the material, None if missing, stale or from another cache version."""
+        try:
+            with open(self.path(mp_id), "r") as reader:
+                record = json.load(reader)
+        except (OSError, ValueError):
+            return None
+
+        if record.get("version") != MaterialsProjectCache.CACHE_VERSION:
+            return None
+        if time.time() - record.get("fetched", 0) > self.ttl:
+            return None
+        return record
+
+    def write(self, record):
+        os.makedirs(self.directory, exist_ok=True)
+
+        # write and rename, so that an interrupted write never leaves a broken record
+        path = self.path(record["material_id"])
+        tmp_path = f"{path}.{rng_string(8)}.tmp"
+        with open(tmp_path, "w") as writer:
+            json.dump(record, writer)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def record_from_doc(doc):
+        structure = doc.structure
+        lattice = structure.lattice
+        return {
+            "version": MaterialsProjectCache.CACHE_VERSION,
+            "fetched": time.time(),
+            "material_id": str(doc.material_id),
+            "formula": doc.formula_pretty,
+            "lattice": [lattice.a, lattice.b, lattice.c, lattice.alpha, lattice.beta, lattice.gamma],
+            "positions": [[site.a, site.b, site.c] for site in structure.sites],
+            "numbers": [site.specie.number for site in structure.sites],
+        }
+
+    def _search(self, mp_ids, credentials_path):
+        if self.client != None:
+            return self.client.summary.search(material_ids=mp_ids, fields=MaterialsProjectCache.FIELDS)
+
+        with open(credentials_path) as json_reader:
+            credentials = json.load(json_reader)
+
+        with mp_api_client.MPRester(credentials["MP_API_key"]) as mpr:
+            return mpr.summary.search(material_ids=mp_ids, fields=MaterialsProjectCache.FIELDS)
+
+    def fetch(self, urls, credentials_path=None, refresh=False):
+        """Records of all the materials (urls or ids), {mp_id: record}.
+        The ones not cached (or all of them with refresh) are fetched in a single query and cached."""
+        mp_ids = lmap(urls, MaterialsProjectCache.material_id)
+
+        records = {}
+        if not refresh:
+            for mp_id in mp_ids:
+                record = self.read(mp_id)
+                if record != None:
+                    records[mp_id] = record
+
+        missing = list(dict.fromkeys(lfilt(mp_ids, lambda mp_id: mp_id not in records)))
+        if len(missing) > 0:
+            for doc in self._search(missing, credentials_path):
+                record = MaterialsProjectCache.record_from_doc(doc)
+                self.write(record)
+                records[record["material_id"]] = record
+
+        not_found = lfilt(missing, lambda mp_id: mp_id not in records)
+        if len(not_found) > 0:
+            raise Exception(f"Materials Project has no structures for: {', '.join(not_found)}")
+
+        return {mp_id: records[mp_id] for mp_id in mp_ids}
@@ -22,6 +22,7 @@ class init_lapw_Parameters:
         "kpoints": 1000,
         "x_kdensity": 0.1,
         "kshift": False,
+        "rkmax": 7.0,
         "spin_polarized": True,
         "x_antiferromagnetic": False,
     }
@@ -31,6 +32,23 @@ class init_lapw_Parameters:
         # TODO: allow manual parameter creation
         pass
 
+    @staticmethod
+    def magnetic_configurations(structure, magnetic_species, net_moment=None, **params):
+        """Spin polarized -ask parameters for every symmetry-distinct collinear configuration of the structure
+        (see StructureFile.enumerate_magnetic_configurations), the other parameters are passed on."""
+        configurations = structure.enumerate_magnetic_configurations(
+            magnetic_species, net_moment
+        )
+        return {
+            name: init_lapw_Parameters(
+                **params,
+                lstart_flag="ask",
+                x_ask_flags_pattern=pattern,
+                spin_polarized=True,
+            )
+            for name, pattern in configurations.items()
+        }
+
     def __init__(
         self,
         reduction_percentage: int = None,
@@ -44,6 +62,7 @@ class init_lapw_Parameters:
         kpoints: int = None,
         x_kdensity: float = None,
         kshift: bool = None,
+        rkmax: float = None,  # RMT*KMAX of case.in1, set after the init
         spin_polarized: bool = None,
         x_antiferromagnetic: bool = None,
     ) -> None:
@@ -59,6 +78,7 @@ class init_lapw_Parameters:
         self.kpoints = kpoints
         self.x_kdensity = x_kdensity
         self.kshift = kshift
+        self.rkmax = rkmax
         self.spin_polarized = spin_polarized
         self.x_antiferromagnetic = x_antiferromagnetic
 
@@ -78,7 +98,7 @@ class init_lapw_Parameters:
 
         for k in self.raw_params:
             # handle floats
-            if k in ["separation_energy_eV", "x_kdensity"]:
+            if k in ["separation_energy_eV", "x_kdensity", "rkmax"]:
                 self.text_params[k] = str(float(self.raw_params[k]))
 
             # handle ints
@@ -227,13 +247,11 @@ class init_lapw_Parameters:
 
         MF.cmd.type(self.text_params["lstart_flag"])
         if self.text_params["lstart_flag"] == "-ask":
-            for i in range(MF.structure.non_eq_count):
-                MF.cmd.type(
-                    self.text_params["x_ask_flags_pattern"][
-                        i % self.text_params["x_ask_flags_pattern"].__len__()
-                    ],
-                    0.2,
-                )
+            # one flag per non-equivalent atom, in the order of the equivalence classes of the struct
+            for flag in MF.structure.get_ask_flags(
+                self.text_params["x_ask_flags_pattern"]
+            ):
+                MF.cmd.type(flag, 0.2)
         MF.cmd.type(self.text_params["calculation_method"])
         MF.cmd.type(self.text_params["separation_energy_eV"])
         MF.cmd.type("^X", do_ENTER=False)
@@ -425,6 +443,8 @@ class init_so_lapw_Parameters:
 
 
 class UJ_Parameters:
+    """U/J (-orb) inputs. Atom indices count the supercell atoms from 1 in the .poscar order. With symmetry on,
+    the struct holds one atom per equivalence class, so they are mapped onto those classes when written (see struct_atoms)."""
 
     @staticmethod
     def atom(index, orbitals=[], r_id=0, l_s_id=0):
@@ -486,7 +506,36 @@ class UJ_Parameters:
                 }
             )
 
-        self.inorb_text = "\n".join(
+        self.parsed_atoms = parsed_atoms
+
+    def struct_atoms(self, structure):
+        """The parsed atoms with their atom numbers turned into the non-equivalent atom numbers of the struct.
+        The atom numbers count the supercell atoms in the .poscar order from 1 (as when every atom was written
+        as non-equivalent), the struct only lists one atom per equivalence class, so atoms of one class are merged."""
+        class_numbers = {}
+        for number, group in enumerate(structure.get_equivalent_atom_groups()):
+            for index in group:
+                class_numbers[int(index) + 1] = number + 1
+
+        struct_atoms = {}
+        for atom in self.parsed_atoms:
+            index = int(atom["index"])
+            if index not in class_numbers:
+                raise Exception(
+                    f"U/J atom {index} is not in the structure (atoms are numbered 1 to {len(class_numbers)})."
+                )
+
+            number = class_numbers[index]
+            if number in struct_atoms:
+                print(f"U/J atom {index} is equivalent to atom {struct_atoms[number]['atom']}, written once.")
+                continue
+            struct_atoms[number] = {**atom, "index": str(number), "atom": index}
+
+        return list(struct_atoms.values())
+
+    def generate_files(self, parsed_atoms):
+        """The case.inorb and case.indmc texts for the atoms (see struct_atoms)."""
+        inorb_text = "\n".join(
             [
                 f"  1  {len(parsed_atoms)}  0",
                 "PRATT,1.0",
@@ -496,7 +545,7 @@ class UJ_Parameters:
                         lambda at: f'{at["index"]} {len(at["orbitals"])} {" ".join(at["orbitals"])}',
                     )
                 ),
-                f"  {nsic}",
+                f"  {self.nsic}",
                 "\n".join(
                     lmap(
                         parsed_atoms,
@@ -506,7 +555,7 @@ class UJ_Parameters:
             ]
         )
 
-        self.indmc_text = "\n".join(
+        indmc_text = "\n".join(
             [
                 f"{self.cutoff_energy}",
                 f" {len(parsed_atoms)}",
@@ -525,18 +574,20 @@ class UJ_Parameters:
             ]
         )
 
-    def execute(self, MF):
+        return (inorb_text, indmc_text)
+
+    async def execute(self, MF):
+        (inorb_text, indmc_text) = self.generate_files(self.struct_atoms(MF.structure))
+
         inorb_path = f"{MF.material}{rng_string(16)}.inorb"
         with open(inorb_path, "w") as f:
-            f.write(self.inorb_text)
+            f.write(inorb_text)
         indmc_path = f"{MF.material}{rng_string(16)}.indmc"
         with open(indmc_path, "w") as f:
-            f.write(self.indmc_text)
-
-        MF.scp.upload_file(inorb_path, f"{MF.material}.inorb")
-        MF.scp.upload_file(indmc_path, f"{MF.material}.indmc")
+            f.write(indmc_text)
 
-        time.sleep(1)
+        await MF.scp.upload(inorb_path, f"{MF.material}.inorb")
+        await MF.scp.upload(indmc_path, f"{MF.material}.indmc")
 
         os.remove(inorb_path)
         os.remove(indmc_path)
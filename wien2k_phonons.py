@@ -0,0 +1,155 @@
+from wien2_helper import *
+from wien2k_symmetry import *
+
+import numpy as np
+import re
+
+# mRy/bohr (WIEN2k forces) -> eV/angstrom
+MRY_PER_BOHR_TO_EV_PER_A = 1e-3 * Constants.Ry_to_eV / Constants.bohr_to_angstrom
+
+
+def parse_forces(scf_text, atom_count):
+    """(atom_count,3) total forces in eV/angstrom from the last :FGL block of a case.scf (global cartesian frame)."""
+    forces = re.findall(
+        r":FGL\d+:\s+\d+\.ATOM\s+([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)", scf_text
+    )
+    if len(forces) < atom_count:
+        raise Exception(f"Only {len(forces)} :FGL forces found for {atom_count} atoms, was the run done with -fc?")
+    return np.array(forces[-atom_count:], dtype=float) * MRY_PER_BOHR_TO_EV_PER_A
+
+
+class PhononSet:
+    """Finite-displacement phonon supercells. Only the symmetry-irreducible displacements are run,
+    the force constants of all atoms are assembled from them with the supercell's symmetry operations."""
+
+    # forces are computed (and converged to 0.1 mRy/bohr) only with -fc
+    RUN_FLAGS = "-fc 0.1"
+
+    # candidate displacement directions, the first ones whose symmetric images span 3D are used
+    CANDIDATE_DIRECTIONS = np.array(
+        [[1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0], [1, 0, 1], [0, 1, 1], [1, 1, 1]],
+        dtype=float,
+    )
+
+    def __init__(self, structure, supercell=(2, 2, 2), amplitude=0.01, symprec=1e-5):
+        """supercell: the cell multiples (a, b, c) or a diagonal 3x3 matrix, amplitude in angstroms."""
+        supercell = np.asarray(supercell)
+        if supercell.ndim == 2:
+            if np.count_nonzero(supercell - np.diag(np.diag(supercell))) > 0:
+                raise Exception("Only diagonal supercell matrices are supported (cell multiples).")
+            supercell = np.diag(supercell)
+
+        cell = structure.copy()
+        cell.tweak_cell_multiples(*lmap(supercell, int))
+        self.supercell = cell.get_supercell_structure()
+        self.amplitude = amplitude
+
+        self.lattice_matrix = self.supercell.get_lattice_matrix()
+        positions, numbers = self.supercell.positions, self.supercell.numbers
+
+        symmetry = detect_symmetry(self.lattice_matrix, positions, numbers, symprec=symprec)
+        if symmetry == None:
+            raise Exception("Could not determine the symmetry of the supercell.")
+        self.permutations = site_permutations(
+            positions, numbers, symmetry["rotations"], symmetry["translations"]
+        )
+        # cartesian rotations, R_cart = L^T R L^-T for the lattice vectors as rows
+        self.rotations = np.einsum(
+            "ji,mjk,kl->mil",
+            self.lattice_matrix,
+            symmetry["rotations"],
+            np.linalg.inv(self.lattice_matrix).T,
+        )
+        self.representatives = np.unique(symmetry["equivalent_atoms"])
+        self.equivalent_atoms = symmetry["equivalent_atoms"]
+
+        # (atom, cartesian displacement) of every run
+        self.displacements = []
+        for atom in self.representatives:
+            for direction in self._irreducible_directions(atom):
+                self.displacements.append((int(atom), direction * amplitude))
+
+    def _site_operations(self, atom):
+        return np.flatnonzero(self.permutations[:, atom] == atom)
+
+    def _irreducible_directions(self, atom):
+        site_rotations = self.rotations[self._site_operations(atom)]
+
+        chosen = []
+        images = np.zeros((0, 3))
+        for candidate in PhononSet.CANDIDATE_DIRECTIONS:
+            candidate = candidate / np.linalg.norm(candidate)
+            new_images = np.vstack([images, site_rotations @ candidate])
+            if np.linalg.matrix_rank(new_images, tol=1e-6) > np.linalg.matrix_rank(images, tol=1e-6):
+                chosen.append(candidate)
+                images = new_images
+            if np.linalg.matrix_rank(images, tol=1e-6) == 3:
+                break
+        return chosen
+
+    def structures(self):
+        """{run name: displaced supercell} of the irreducible displacements. The supercells are written
+        without symmetry reduction, so that :FGL lists the force on every atom in the supercell order."""
+        inverse_lattice = np.linalg.inv(self.lattice_matrix)
+
+        displaced = {}
+        for index, (atom, displacement) in enumerate(self.displacements):
+            structure = self.supercell.copy()
+            structure.use_symmetry = False
+            structure.positions[atom] = (structure.positions[atom] + displacement @ inverse_lattice) % 1.0
+            structure.add_tweak_message(
+                f"Displacement : atom {atom} : {np.round(displacement, 6).tolist()} A"
+            )
+            displaced[f"disp_{index}"] = structure
+        return displaced
+
+    @staticmethod
+    def _forces(result, atom_count):
+        # (N,3) forces straight away or the run details saved by MaterialFolder
+        if isinstance(result, dict):
+            return np.asarray(result["results"]["forces_eV_per_A"], dtype=float)
+        return np.asarray(result, dtype=float).reshape(atom_count, 3)
+
+    def force_constants(self, results):
+        """Force constants (N,3,N,3) in eV/angstrom^2 from {run name: forces (N,3) or run details}.
+        The displacements of every representative are expanded by its site symmetry and solved in one
+        least squares, then rotated onto the other atoms of its orbit."""
+        atom_count = len(self.supercell.numbers)
+        constants = np.zeros((atom_count, 3, atom_count, 3))
+
+        for atom in self.representatives:
+            runs = [
+                (displacement, PhononSet._forces(results[f"disp_{index}"], atom_count))
+                for index, (displaced_atom, displacement) in enumerate(self.displacements)
+                if displaced_atom == atom
+            ]
+            displacements = np.array([run[0] for run in runs])
+            forces = np.array([run[1] for run in runs])
+
+            # every site symmetry operation turns a displacement into another one with moved and rotated forces
+            operations = self._site_operations(atom)
+            all_displacements = np.einsum("gij,kj->gki", self.rotations[operations], displacements)
+            rotated = np.einsum("gij,knj->gkni", self.rotations[operations], forces)
+            all_forces = np.empty_like(rotated)
+            for g, operation in enumerate(operations):
+                all_forces[g][:, self.permutations[operation]] = rotated[g]
+
+            # F = -u . Phi for all (displacement, forces) pairs at once
+            solution, _, _, _ = np.linalg.lstsq(
+                all_displacements.reshape(-1, 3),
+                -all_forces.reshape(-1, atom_count * 3),
+                rcond=None,
+            )
+            constants[atom] = solution.reshape(3, atom_count, 3)
+
+        # the other atoms of each orbit from an operation moving the representative onto them
+        for atom in range(atom_count):
+            representative = self.equivalent_atoms[atom]
+            if atom == representative:
+                continue
+            operation = np.flatnonzero(self.permutations[:, representative] == atom)[0]
+            rotation = self.rotations[operation]
+            moved = np.einsum("ai,inj,bj->anb", rotation, constants[representative], rotation)
+            constants[atom][:, self.permutations[operation]] = moved
+
+        return constants
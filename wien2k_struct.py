@@ -1,14 +1,20 @@
 from wien2_helper import *
+from wien2k_elements import *
+from wien2k_symmetry import *
+from wien2k_materials_project import *
 
-import mendeleev
 import numpy as np
-import re, json
+import re, json, functools
+from fractions import Fraction
 
-from mp_api.client import MPRester
-from pyxtal.lattice import para2matrix
+# optional features, imported on first use
+pyxtal_lattice = lazy_import("pyxtal.lattice")
+scipy_spatial = lazy_import("scipy.spatial")
 
 
 class StructureAtom:
+    __slots__ = ("x", "y", "z", "Z")
+
     def __init__(
         self,
         x,
@@ -23,7 +29,58 @@ class StructureAtom:
         self.Z = Z
 
     def get_symbol(self):
-        return mendeleev.element(int(self.Z)).symbol
+        return element_symbol(self.Z)
+
+    def __repr__(self):
+        return f"<wien2k_struct.StructureAtom {self.x} {self.y} {self.z} {self.Z}>"
+
+    def __str__(self):
+        return f"<wien2k_struct.StructureAtom {self.x} {self.y} {self.z} {self.Z}>"
+
+
+class StructureAtomView:
+    """Per-atom access to the arrays of a StructureFile, changes are written through to them."""
+
+    __slots__ = ("structure", "index")
+
+    def __init__(self, structure, index):
+        self.structure = structure
+        self.index = index
+
+    @property
+    def x(self):
+        return float(self.structure.positions[self.index, 0])
+
+    @x.setter
+    def x(self, value):
+        self.structure.positions[self.index, 0] = value
+
+    @property
+    def y(self):
+        return float(self.structure.positions[self.index, 1])
+
+    @y.setter
+    def y(self, value):
+        self.structure.positions[self.index, 1] = value
+
+    @property
+    def z(self):
+        return float(self.structure.positions[self.index, 2])
+
+    @z.setter
+    def z(self, value):
+        self.structure.positions[self.index, 2] = value
+
+    @property
+    def Z(self):
+        return int(self.structure.numbers[self.index])
+
+    @Z.setter
+    def Z(self, value):
+        self.structure.numbers[self.index] = value
+
+    def get_symbol(self):
+        return element_symbol(self.Z)
 
     def __repr__(self):
         return f"<wien2k_struct.StructureAtom {self.x} {self.y} {self.z} {self.Z}>"
@@ -33,6 +90,117 @@ class StructureAtom:
 
 
 class StructureFile:
+    # --------------- LINE FORMATTING ---------------
+    # A = any, I = integer, F = float, X = empty spaces, '...' = literal label
+    LINE_FORMATS = [
+        None,  # indexing from 1 offset
+        "A80",  # 1: title line (any)
+        "A4,'LATTICE,NONEQUIV.ATOMS:',I3",  # 2: lattice type and non-equivalent atoms count
+        "'MODE OF CALC=',A4,' unit=bohr'",  # 3: calculation mode (RELA/NREL)
+        "6F10.6",  # 4: unit parameters a,b,c,alpha,beta,gamma
+        "'ATOM',I4,': X=',F10.8,' Y=',F10.8,' Z=',F10.8",  # 5: atom index, x, y, z
+        "'          MULT=',I2,'          ISPLIT=',I2",  # 6: MULT, ISPLIT
+        "A10,' NPT=',I5,'  R0=',F10.8,' RMT=',F10.5,'   Z:',F10.5",  # 7: atom label, NPT, R0, RMT, Z
+        "'LOCAL ROT MATRIX:   ',3F10.7",  # 8: rotational matrix line 1
+        "20X,3F10.7",  # 9: rotational matrix line 2
+        "20X,3F10.7",  # 10: rotational matrix line 3
+        "I4,'      NUMBER OF SYMMETRY OPERATIONS'",  # 11: number of symmetry operations,
+        "3I2,F11.8",  # 12: operation matrix line1, translation vector x
+        "3I2,F11.8",  # 13: operation matrix line2, translation vector y
+        "3I2,F11.8",  # 14: operation matrix line3, translation vector z
+        "I8",  # 15: above symmetry operation index
+    ]
+
+    LATTICE_TYPES = ["P", "F", "B", "CXY", "CYZ", "CXZ", "R", "H"]
+    # translations implied by the centered lattice types, only one atom of each set is listed in a .struct
+    LATTICE_CENTERINGS = {
+        "P": [[0, 0, 0]],
+        "H": [[0, 0, 0]],
+        "B": [[0, 0, 0], [0.5, 0.5, 0.5]],
+        "F": [[0, 0, 0], [0, 0.5, 0.5], [0.5, 0, 0.5], [0.5, 0.5, 0]],
+        "CXY": [[0, 0, 0], [0.5, 0.5, 0]],
+        "CYZ": [[0, 0, 0], [0, 0.5, 0.5]],
+        "CXZ": [[0, 0, 0], [0.5, 0, 0.5]],
+    }
+
+    # atom defaults of the generated .struct files
+    DEFAULT_NPT = 781
+    DEFAULT_RMT = 2.0  # bohr, setrmt adjusts it during init_lapw unless the radii are discarded
+    DEFAULT_ISPLIT = 8
+
+    # muffin-tin radii limits (bohr) of the local neighbour checks
+    MIN_RMT = 0.5
+    MAX_RMT = 2.5
+    NEIGHBOUR_COUNT = 12
+
+    @staticmethod
+    def default_R0(Z):
+        # finer radial mesh start for the heavier elements
+        return 0.0001 if Z <= 20 else 0.00005
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def compile_format(form):
+        """Splits a line format into (type, width, precision, literal) fields, cached per format."""
+        fields = []
+        for instruction in re.findall(r"'[^']*'|[^,]+", form):
+            if instruction.startswith("'"):
+                literal = instruction[1:-1]
+                fields.append(("L", len(literal), 0, literal))
+                continue
+
+            [repetitions, val_type, width] = re.findall(
+                r"^(\d*)([AIFX])([\d\.]*)$", instruction
+            )[0]
+            repetitions = int(repetitions) if repetitions != "" else 1
+
+            if val_type == "X":
+                # nX is n spaces
+                fields.append(("L", repetitions, 0, " " * repetitions))
+                continue
+
+            precision = 0
+            if "." in width:
+                [width, precision] = width.split(".")
+            fields += [(val_type, int(width), int(precision), "")] * repetitions
+
+        return tuple(fields)
+
+    @staticmethod
+    def apply_format(form, replaces):
+        line = ""
+        rid = 0
+        for val_type, width, precision, literal in StructureFile.compile_format(form):
+            if val_type == "L":
+                line += literal
+                continue
+
+            if val_type == "A":
+                line += str(replaces[rid]).ljust(width)[0:width]
+            elif val_type == "I":
+                line += str(int(replaces[rid])).rjust(width)[-width:]
+            elif val_type == "F":
+                line += format(replaces[rid], f".{precision}f").rjust(width)[-width:]
+            rid += 1
+
+        return line + "\n"
+
+    @staticmethod
+    def parse_format(form, line):
+        output = []
+        start = 0
+        for val_type, width, precision, literal in StructureFile.compile_format(form):
+            field = line[start : start + width]
+            start += width
+
+            if val_type == "A":
+                output.append(field.strip())
+            elif val_type == "I":
+                output.append(int(field))
+            elif val_type == "F":
+                output.append(float(field))
+
+        return output
 
     # --------------- CREATION ---------------
     # all in angstroms
@@ -75,45 +243,386 @@ class StructureFile:
         self.gamma = gamma
 
         # atomic info
+        # fractional positions (N,3) and atomic numbers (N,) of the unit cell
         self.atoms = atoms
         self.non_eq_count = 0
 
+        # muffin-tin radii (bohr) by atomic number, the default one is used for the others
+        self.rmt = {}
+
+        # u/d/n moment pattern repeated over the supercell atoms (as for lstart -ask), None if not magnetic
+        self.moment_pattern = None
+
+        # symmetry of the supercell, when disabled every atom is written as non-equivalent
+        self.use_symmetry = True
+        self.symprec = 1e-5
+        self.spacegroup_symbol = "P1"
+        self.spacegroup_number = 1
+        self.equivalent_atoms = np.zeros(0, dtype=int)
+        self.symmetry_rotations = np.eye(3, dtype=int)[None, :, :]
+        self.symmetry_translations = np.zeros((1, 3))
+
+    @staticmethod
+    def from_arrays(
+        title,
+        positions,
+        numbers,
+        a,
+        b=None,
+        c=None,
+        alpha=90.0,
+        beta=90.0,
+        gamma=90.0,
+    ):
+        structure = StructureFile(title, [], a, b, c, alpha, beta, gamma)
+        structure.positions = np.array(positions, dtype=float).reshape(-1, 3)
+        structure.numbers = np.array(numbers, dtype=int).reshape(-1)
+        return structure
+
+    def copy(self):
+        structure = StructureFile.from_arrays(
+            self.title,
+            self.positions,
+            self.numbers,
+            self.a,
+            self.b,
+            self.c,
+            self.alpha,
+            self.beta,
+            self.gamma,
+        )
+        structure.cell_multiples = dict(self.cell_multiples)
+        structure.tweak_logs = list(self.tweak_logs)
+        structure.rmt = dict(self.rmt)
+        structure.moment_pattern = (
+            lmap(self.moment_pattern, lambda flags: list(flags) if isinstance(flags, list) else flags)
+            if self.moment_pattern != None
+            else None
+        )
+        structure.use_symmetry = self.use_symmetry
+        structure.symprec = self.symprec
+        return structure
+
+    @property
+    def atoms(self):
+        """Views of the atoms that write through to the arrays. A tuple, so the atom list itself
+        only changes through add_atom/remove_atom (or by assigning a whole new list)."""
+        return tuple(StructureAtomView(self, i) for i in range(len(self.numbers)))
+
+    @atoms.setter
+    def atoms(self, atoms):
+        self.positions = np.array(
+            [[at.x, at.y, at.z] for at in atoms], dtype=float
+        ).reshape(-1, 3)
+        self.numbers = np.array([at.Z for at in atoms], dtype=int)
+
     def get_mutliples_count(self):
         return self.cell_multiples["a"] * self.cell_multiples["b"] * self.cell_multiples["c"]
 
+    @staticmethod
+    def load(filepath):
+        """Loads a wien2k .struct file."""
+        with open(filepath, "r") as reader:
+            lines = reader.read().split("\n")
+
+        F = StructureFile.LINE_FORMATS
+        [title] = StructureFile.parse_format(F[1], lines[0])
+        [lattice_type, non_eq] = StructureFile.parse_format(F[2], lines[1])
+        [a, b, c, alpha, beta, gamma] = StructureFile.parse_format(F[4], lines[3])
+
+        if lattice_type not in StructureFile.LATTICE_CENTERINGS:
+            raise Exception(f"Loading the '{lattice_type}' lattice type is not supported.")
+
+        positions = []
+        numbers = []
+        rmt = {}
+
+        line_id = 4
+        for i in range(non_eq):
+            [_, x, y, z] = StructureFile.parse_format(F[5], lines[line_id])
+            [mult, _] = StructureFile.parse_format(F[6], lines[line_id + 1])
+            atom_positions = [[x, y, z]]
+            line_id += 2
+
+            for j in range(mult - 1):
+                [_, x, y, z] = StructureFile.parse_format(F[5], lines[line_id])
+                atom_positions.append([x, y, z])
+                line_id += 1
+
+            [_, _, _, RMT, Z] = StructureFile.parse_format(F[7], lines[line_id])
+            # skip the label line and the local rotation matrix
+            line_id += 4
+
+            positions += atom_positions
+            numbers += [int(round(Z))] * mult
+            rmt[int(round(Z))] = RMT
+
+        # add the atoms implied by the lattice centering
+        centerings = np.asarray(StructureFile.LATTICE_CENTERINGS[lattice_type])
+        positions = (
+            (np.asarray(positions)[None, :, :] + centerings[:, None, :]) % 1.0
+        ).reshape(-1, 3)
+        numbers = np.tile(numbers, len(centerings))
+
+        structure = StructureFile.from_arrays(
+            title,
+            positions,
+            numbers,
+            a * Constants.bohr_to_angstrom,
+            b * Constants.bohr_to_angstrom,
+            c * Constants.bohr_to_angstrom,
+            alpha,
+            beta,
+            gamma,
+        )
+        structure.filepath = filepath
+        structure.rmt = rmt
+        return structure
+
+    @staticmethod
+    def lattice_parameters(lattice_matrix):
+        """(a, b, c, alpha, beta, gamma) of a lattice given by its row vectors."""
+        lattice_matrix = np.asarray(lattice_matrix, dtype=float)
+        lengths = np.linalg.norm(lattice_matrix, axis=1)
+
+        def angle(i, j):
+            cosine = lattice_matrix[i] @ lattice_matrix[j] / (lengths[i] * lengths[j])
+            return float(np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0))))
+
+        return (*lengths.tolist(), angle(1, 2), angle(0, 2), angle(0, 1))
+
+    @staticmethod
+    def _poscar_symbol(token):
+        # potcar labels like Fe_pv or Fe/1234abcd
+        return re.split(r"[_/.]", token)[0]
+
+    @staticmethod
+    def iter_poscar(filepath):
+        """Lazily yields every structure of a POSCAR-like file: a POSCAR/CONTCAR, several POSCARs
+        one after another or an XDATCAR trajectory (with a fixed or a changing cell)."""
+        with open(filepath, "r") as reader:
+            lines = (line for line in reader if line.strip() != "")
+
+            header = None
+            for line in lines:
+                if header != None and re.fullmatch(r"(\s*[-+.\dEe]+){3}\s*", line):
+                    # the velocities block of a CONTCAR
+                    for i in range(len(header[2]) - 1):
+                        next(lines)
+                    continue
+
+                if header == None or not re.match(r"\s*(direct|cartesian)\s+configuration", line, re.I):
+                    # a new header, the title line of a POSCAR or of an XDATCAR (frame)
+                    title = line.strip()
+                    scale = float(next(lines).split()[0])
+                    lattice_matrix = np.array(
+                        [next(lines).split()[:3] for i in range(3)], dtype=float
+                    )
+                    if scale < 0:
+                        # a negative scale is the cell volume
+                        scale = (-scale / abs(np.linalg.det(lattice_matrix))) ** (1.0 / 3.0)
+                    lattice_matrix *= scale
+
+                    tokens = next(lines).split()
+                    if all(token.isdigit() for token in tokens):
+                        # vasp 4 files have no species line, the symbols are taken from the title
+                        counts = lmap(tokens, int)
+                        symbols = title.split()[: len(counts)]
+                    else:
+                        symbols = lmap(tokens, StructureFile._poscar_symbol)
+                        counts = lmap(next(lines).split(), int)
+                    numbers = np.repeat(lmap(symbols, atomic_number), counts)
+
+                    line = next(lines)
+                    if line.strip()[0] in "sS":
+                        # selective dynamics
+                        line = next(lines)
+                    header = (title, lattice_matrix, numbers, scale)
+
+                title, lattice_matrix, numbers, scale = header
+                is_cartesian = line.strip()[0] in "cCkK"
+
+                positions = np.array(
+                    [next(lines).split()[:3] for i in range(len(numbers))], dtype=float
+                )
+                if is_cartesian:
+                    positions = positions * scale @ np.linalg.inv(lattice_matrix)
+
+                structure = StructureFile.from_arrays(
+                    title,
+                    positions % 1.0,
+                    numbers,
+                    *StructureFile.lattice_parameters(lattice_matrix),
+                )
+                structure.filepath = filepath
+                yield structure
+
     @staticmethod
     def load_poscar(filepath):
-        # TODO:
-        pass
+        """Loads a POSCAR/CONTCAR (the first structure of the file)."""
+        return next(StructureFile.iter_poscar(filepath))
+
+    # tokens of a cif line: quoted strings or whitespace separated words, # starts a comment
+    CIF_TOKEN = re.compile(r"""'[^']*'(?=\s|$)|"[^"]*"(?=\s|$)|#.*|\S+""")
+
+    @staticmethod
+    def _cif_blocks(reader):
+        # yields (block name, {tag: value}, [{tag: [values]}]) of every data_ block
+        name, tags, loops = None, {}, []
+        loop = None
+        last_tag = None
+
+        text_field = None
+        for line in reader:
+            # ;-delimited multi line text fields are single values
+            if line.startswith(";"):
+                if text_field == None:
+                    text_field = [line[1:]]
+                    continue
+                tokens = ["".join(text_field)]
+                text_field = None
+            elif text_field != None:
+                text_field.append(line)
+                continue
+            else:
+                tokens = lfilt(StructureFile.CIF_TOKEN.findall(line), lambda t: not t.startswith("#"))
+
+            for token in tokens:
+                lower = token.lower()
+                if lower.startswith("data_"):
+                    if name != None:
+                        yield name, tags, loops
+                    name, tags, loops = token[5:], {}, []
+                    loop = None
+                elif lower == "loop_":
+                    loop = {"tags": [], "values": []}
+                    loops.append(loop)
+                elif token.startswith("_"):
+                    if loop != None and len(loop["values"]) == 0:
+                        loop["tags"].append(lower)
+                    else:
+                        loop = None
+                        tags[lower] = None
+                        last_tag = lower
+                elif loop != None:
+                    loop["values"].append(token.strip("'\""))
+                else:
+                    tags[last_tag] = token.strip("'\"")
+
+        if name != None:
+            yield name, tags, loops
+
+    @staticmethod
+    def _cif_number(value):
+        # strips the uncertainty, 5.6402(3) -> 5.6402
+        return float(value.split("(")[0])
+
+    @staticmethod
+    def _cif_symmetry_operation(text):
+        # "-x+1/2, y, z+1/2" -> rotation matrix and translation
+        rotation = np.zeros((3, 3))
+        translation = np.zeros(3)
+        for row, component in enumerate(text.replace(" ", "").lower().split(",")):
+            for sign, number, axis in re.findall(r"([+-]?)([\d./]*)\*?([xyz]?)", component):
+                if number == "" and axis == "":
+                    continue
+                value = float(Fraction(number)) if number != "" else 1.0
+                value = -value if sign == "-" else value
+                if axis != "":
+                    rotation[row, "xyz".index(axis)] += value
+                else:
+                    translation[row] += value
+        return rotation, translation
+
+    @staticmethod
+    def iter_cif(filepath, tol=1e-4):
+        """Lazily yields the structure of every data_ block of a cif file.
+        The listed sites are expanded by the symmetry operations of the block (if there are any)."""
+        with open(filepath, "r") as reader:
+            for name, tags, loops in StructureFile._cif_blocks(reader):
+                sites = None
+                operations = ["x,y,z"]
+                for loop in loops:
+                    columns = {
+                        tag: loop["values"][i :: len(loop["tags"])]
+                        for i, tag in enumerate(loop["tags"])
+                    }
+                    if "_atom_site_fract_x" in columns:
+                        sites = columns
+                    for tag in ["_space_group_symop_operation_xyz", "_symmetry_equiv_pos_as_xyz"]:
+                        if tag in columns:
+                            operations = columns[tag]
+
+                if sites == None:
+                    continue
+
+                labels = sites.get("_atom_site_type_symbol", sites.get("_atom_site_label"))
+                numbers = lmap(
+                    labels, lambda label: atomic_number(re.match(r"[A-Z][a-z]?", label).group(0))
+                )
+                positions = np.array(
+                    [
+                        lmap(sites[f"_atom_site_fract_{axis}"], StructureFile._cif_number)
+                        for axis in "xyz"
+                    ]
+                ).T
+
+                rotations, translations = zip(*lmap(operations, StructureFile._cif_symmetry_operation))
+                positions, numbers, _, _ = expand_orbits(
+                    positions, numbers, rotations, translations, tol=tol
+                )
+
+                structure = StructureFile.from_arrays(
+                    tags.get("_chemical_formula_sum") or name,
+                    positions,
+                    numbers,
+                    *[
+                        StructureFile._cif_number(tags[f"_cell_{key}"])
+                        for key in [
+                            "length_a",
+                            "length_b",
+                            "length_c",
+                            "angle_alpha",
+                            "angle_beta",
+                            "angle_gamma",
+                        ]
+                    ],
+                )
+                structure.filepath = filepath
+                yield structure
 
     @staticmethod
     def load_cif(filepath):
-        # TODO ??
-        pass
-
-    def load_materials_project(url, credentials_path):
-        with open(credentials_path) as json_reader:
-            credentials = json.load(json_reader)
-
-        material = None
-        with MPRester(credentials["MP_API_key"]) as mpr:
-            docs = mpr.summary.search(material_ids=re.findall(r"mp-\d+", url))
-            material = docs[0]
-
-        return StructureFile(
-            material.formula_pretty,
-            lmap(
-                material.structure.sites,
-                lambda site: StructureAtom(site.a, site.b, site.c, site.specie.number),
-            ),
-            material.structure.lattice.a,
-            material.structure.lattice.b,
-            material.structure.lattice.c,
-            material.structure.lattice.alpha,
-            material.structure.lattice.beta,
-            material.structure.lattice.gamma,
+        """Loads a cif file (the first structure of the file)."""
+        return next(StructureFile.iter_cif(filepath))
+
+    @staticmethod
+    def from_materials_project_record(record):
+        return StructureFile.from_arrays(
+            record["formula"],
+            record["positions"],
+            record["numbers"],
+            *record["lattice"],
         )
 
+    @staticmethod
+    def load_materials_project(url, credentials_path, cache=None, refresh=False):
+        """Loads a Materials Project structure, through the local cache (see MaterialsProjectCache)."""
+        cache = cache if cache != None else MaterialsProjectCache()
+        [record] = cache.fetch([url], credentials_path, refresh).values()
+        return StructureFile.from_materials_project_record(record)
+
+    @staticmethod
+    def load_materials_project_batch(urls, credentials_path, cache=None, refresh=False):
+        """Loads many Materials Project structures at once, the uncached ones in a single query.
+        Returns {mp_id: StructureFile}."""
+        cache = cache if cache != None else MaterialsProjectCache()
+        records = cache.fetch(urls, credentials_path, refresh)
+        return {
+            mp_id: StructureFile.from_materials_project_record(record)
+            for mp_id, record in records.items()
+        }
+
     # --------------- TWEAKING ---------------
 
     def add_tweak_message(self, message):
@@ -144,6 +653,34 @@ class StructureFile:
 
         self.update_symmetry()
 
+    def generate_strained(self, strains):
+        """Lazily yields a copy of the structure for every (3,3) strain tensor of the batch (K,3,3),
+        the lattice vectors deformed by (I + strain) all at once and the fractional positions kept."""
+        strains = np.asarray(strains, dtype=float).reshape(-1, 3, 3)
+        lattices = np.einsum(
+            "ij,kmj->kim",
+            self.get_lattice_matrix(with_multiples=False),
+            np.eye(3) + strains,
+        )
+
+        # lattice parameters of every strained cell
+        lengths = np.linalg.norm(lattices, axis=2)
+        cosines = np.stack(
+            [
+                np.einsum("kj,kj->k", lattices[:, i], lattices[:, j]) / (lengths[:, i] * lengths[:, j])
+                for i, j in [(1, 2), (0, 2), (0, 1)]
+            ],
+            axis=1,
+        )
+        angles = np.degrees(np.arccos(np.clip(cosines, -1.0, 1.0)))
+
+        for strain, (a, b, c), (alpha, beta, gamma) in zip(strains, lengths, angles):
+            structure = self.copy()
+            structure.a, structure.b, structure.c = a, b, c
+            structure.alpha, structure.beta, structure.gamma = alpha, beta, gamma
+            structure.add_tweak_message(f"Strain : {(np.round(strain, 6) + 0.0).tolist()}")
+            yield structure
+
     def tweak_cell_multiples(self, a=1, b=1, c=1):
         old = self.cell_multiples
         self.cell_multiples = {
@@ -155,6 +692,8 @@ class StructureFile:
             f"Cell multiples: ({old['a']},{old['b']},{old['c']}) -> ({self.cell_multiples['a']},{self.cell_multiples['b']},{self.cell_multiples['c']})"
         )
 
+        self.update_symmetry()
+
     def tweak_atom(
         self,
         index,
@@ -163,111 +702,528 @@ class StructureFile:
         z=None,
         atomic_number=None,
     ):
-        if index >= len(self.atoms) or index < 0:
+        if index >= len(self.numbers) or index < 0:
             self.add_tweak_message(f"Atom {index}: FAILED : INVALID INDEX")
             raise Exception(
                 "Atom index out of range (indexing is from 0 in the order as in the struct file)."
             )
 
-        if x != None:
+        # clamp between 0-1 so that the atom is kep inside the cell
+        for axis, value in enumerate([x, y, z]):
+            if value != None:
+                clamped = sorted([0.0, value, 1.0])[1]
+                self.add_tweak_message(
+                    f"Atom {index}: {'xyz'[axis]} : {self.positions[index, axis]} -> {clamped}"
+                )
+                self.positions[index, axis] = clamped
+
+        if atomic_number != None:
+            atom = StructureAtomView(self, index)
+            nsymb = element_symbol(atomic_number)
+
+            self.add_tweak_message(f"Atom {index}: Z : {atom.Z} -> {atomic_number}")
             self.add_tweak_message(
-                f"Atom {index}: x : {self.atoms[index]['x']} -> {sorted([0.0, x, 1.0])[1]}"
+                f"Atom {index}: Symbol : {atom.get_symbol()} -> {nsymb}"
             )
-            self.atoms[index]["x"] = sorted([0.0, x, 1.0])[
-                1
-            ]  # clamp between 0-1 so that the atom is kep inside the cell
-        if y != None:
-            self.add_tweak_message(
-                f"Atom {index}: y : {self.atoms[index]['y']} -> {sorted([0.0, y, 1.0])[1]}"
+
+            self.numbers[index] = atomic_number
+
+        self.update_symmetry()
+
+        return StructureAtomView(self, index)
+
+    def add_atom(self, x, y, z, atomic_number):
+        """Appends an atom (fractional coordinates) to the unit cell."""
+        index = len(self.numbers)
+        self.add_tweak_message(
+            f"Atom {index}: ADDED : {element_symbol(atomic_number)} {x} {y} {z}"
+        )
+        self.positions = np.vstack([self.positions, [[x, y, z]]])
+        self.numbers = np.append(self.numbers, int(atomic_number))
+
+        self.update_symmetry()
+
+        return StructureAtomView(self, index)
+
+    def remove_atom(self, index):
+        """Removes an atom from the unit cell, the later atoms move one index down."""
+        if index >= len(self.numbers) or index < 0:
+            self.add_tweak_message(f"Atom {index}: FAILED : INVALID INDEX")
+            raise Exception(
+                "Atom index out of range (indexing is from 0 in the order as in the struct file)."
             )
-            self.atoms[index]["y"] = sorted([0.0, y, 1.0])[
-                1
-            ]  # clamp between 0-1 so that the atom is kep inside the cell
-        if z != None:
-            self.add_tweak_message(
-                f"Atom {index}: z : {self.atoms[index]['z']} -> {sorted([0.0, z, 1.0])[1]}"
+
+        atom = StructureAtomView(self, index)
+        self.add_tweak_message(
+            f"Atom {index}: REMOVED : {atom.get_symbol()} {atom.x} {atom.y} {atom.z}"
+        )
+        self.positions = np.delete(self.positions, index, axis=0)
+        self.numbers = np.delete(self.numbers, index)
+
+        self.update_symmetry()
+
+    def set_magnetic_moments(self, pattern):
+        """Sets the u/d/n moment pattern (repeated over the supercell atoms in the .struct/.poscar order).
+        Atoms with different moments are kept non-equivalent. None makes the structure non-magnetic again.
+        A list of patterns keeps atoms apart if they differ in any of them (symmetry shared by several configurations)."""
+        if pattern != None:
+            pattern = (
+                lmap(pattern, list)
+                if len(pattern) > 0 and isinstance(pattern[0], (list, tuple))
+                else list(pattern)
             )
-            self.atoms[index]["z"] = sorted([0.0, z, 1.0])[
-                1
-            ]  # clamp between 0-1 so that the atom is kep inside the cell
-        if atomic_number != None:
-            nsymb = mendeleev.element(atomic_number).symbol
+        if pattern != self.moment_pattern:
+            self.add_tweak_message(f"Magnetic moments : {self.moment_pattern} -> {pattern}")
+        self.moment_pattern = pattern
 
-            self.add_tweak_message(
-                f"Atom {index}: Z : {self.atoms[index]['atomic_number']} -> {atomic_number}"
+        self.update_symmetry()
+
+    def group_magnetic_patterns(self, patterns):
+        """Splits moment patterns into groups that can share one symmetry (a list of patterns in set_magnetic_moments):
+        a pattern only joins a group if together they keep as many non-equivalent atoms as each of them alone.
+        Returns the lists of pattern indices."""
+
+        def non_eq_count(indices):
+            structure = self.copy()
+            structure.set_magnetic_moments([patterns[i] for i in indices])
+            return structure.non_eq_count
+
+        counts = lmap(range(len(patterns)), lambda i: non_eq_count([i]))
+        groups = []
+        for i in range(len(patterns)):
+            group = next(
+                (
+                    group
+                    for group in groups
+                    if counts[group[0]] == counts[i] and non_eq_count(group + [i]) == counts[i]
+                ),
+                None,
             )
-            self.add_tweak_message(
-                f"Atom {index}: Symbol : {self.atoms[index]['symbol']} -> {nsymb}"
+            if group == None:
+                groups.append([i])
+            else:
+                group.append(i)
+        return groups
+
+    # --------------- SYMMETRY ---------------
+
+    def get_supercell_moments(self):
+        """Moment flag of every supercell atom in the order of get_supercell_arrays, None if not magnetic.
+        For a list of patterns the flags are (N,k), one column per pattern."""
+        if self.moment_pattern == None or len(self.moment_pattern) == 0:
+            return None
+
+        count = self.get_mutliples_count() * len(self.numbers)
+        if isinstance(self.moment_pattern[0], list):
+            return np.stack(
+                [np.resize(np.array(pattern), count) for pattern in self.moment_pattern],
+                axis=1,
             )
+        return np.resize(np.array(self.moment_pattern), count)
 
-            self.atoms[index]["atomic_number"] = atomic_number
-            self.atoms[index]["symbol"] = nsymb
+    def update_symmetry(self):
+        """Finds the space group and the equivalent atoms of the supercell (magnetic moments included).
+        Falls back to P1 with every atom non-equivalent if symmetry is disabled or cannot be determined."""
+        positions, numbers = self.get_supercell_arrays()
+
+        symmetry = None
+        if self.use_symmetry and len(numbers) > 0:
+            try:
+                symmetry = detect_symmetry(
+                    self.get_lattice_matrix(),
+                    positions,
+                    numbers,
+                    self.get_supercell_moments(),
+                    self.symprec,
+                )
+            except Exception as e:
+                print(f"Error determining symmetry: {e}")
+
+        if symmetry == None:
+            self.spacegroup_symbol = "P1"
+            self.spacegroup_number = 1
+            self.equivalent_atoms = np.arange(len(numbers))
+            self.symmetry_rotations = np.eye(3, dtype=int)[None, :, :]
+            self.symmetry_translations = np.zeros((1, 3))
+            message = "Update symmetry : ERROR" if self.use_symmetry else "Update symmetry : DISABLED"
         else:
-            # nothing changed
-            pass
+            self.spacegroup_symbol = symmetry["spacegroup_symbol"]
+            self.spacegroup_number = symmetry["spacegroup_number"]
+            self.equivalent_atoms = symmetry["equivalent_atoms"]
+            self.symmetry_rotations = symmetry["rotations"]
+            self.symmetry_translations = symmetry["translations"]
+            message = None
+
+        self.non_eq_count = len(np.unique(self.equivalent_atoms))
+        if message == None:
+            message = f"Update symmetry : {self.spacegroup_symbol} {self.spacegroup_number} : NONEQUIV {self.non_eq_count}"
+
+        # only log changes, the symmetry is refreshed on every generated file
+        if message not in self.tweak_logs[-1:]:
+            self.add_tweak_message(message)
+
+        return self.equivalent_atoms
+
+    def get_equivalent_atom_groups(self):
+        """Supercell atom indices of each equivalence class, in the order of the first atom of each class."""
+        return equivalence_groups(self.equivalent_atoms)
+
+    def get_non_equivalent_indices(self):
+        return lmap(self.get_equivalent_atom_groups(), lambda group: group[0])
+
+    def get_ask_flags(self, pattern):
+        """The lstart -ask flag of every non-equivalent atom, taken from the pattern at the index of its first atom."""
+        return lmap(
+            self.get_non_equivalent_indices(),
+            lambda index: pattern[index % len(pattern)],
+        )
+
+    def fingerprint(self):
+        """Canonical hash of the crystal (supercell and magnetic moments included) that does not depend
+        on the atom order, origin, basis or supercell choice, for spotting duplicate structures and runs."""
+        positions, numbers = self.get_supercell_arrays()
+
+        moments = self.get_supercell_moments()
+        if moments is None:
+            return canonical_fingerprint(
+                self.get_lattice_matrix(), positions, numbers, symprec=self.symprec
+            )
+        if moments.ndim == 2:
+            # several patterns side by side (no single spin flip to reduce by)
+            labels = moment_labels(moments)
+            return canonical_fingerprint(
+                self.get_lattice_matrix(),
+                positions,
+                numbers * (labels.max() + 1) + labels,
+                symprec=self.symprec,
+            )
+
+        # a global spin flip gives the same configuration, the lower of the two hashes is kept
+        return min(
+            canonical_fingerprint(
+                self.get_lattice_matrix(),
+                positions,
+                numbers * 3 + np.select([moments == up, moments == down], [1, 2], 0),
+                symprec=self.symprec,
+            )
+            for up, down in [("u", "d"), ("d", "u")]
+        )
+
+    def enumerate_magnetic_configurations(self, magnetic_species, net_moment=None):
+        """All collinear u/d configurations of the supercell atoms of the given species (symbols or atomic numbers)
+        that are distinct up to the space group of the supercell and a global spin flip. The other atoms get n.
+        Returns {name: x_ask_flags_pattern}, "F" for the ferromagnet and "AF1", "AF2", ... for the rest.
+        With net_moment only configurations with |#u - #d| == net_moment are kept."""
+        positions, numbers = self.get_supercell_arrays()
+        species = lmap(
+            magnetic_species,
+            lambda sp: atomic_number(sp) if isinstance(sp, str) else int(sp),
+        )
+        sites = np.flatnonzero(np.isin(numbers, species))
+
+        symmetry = detect_symmetry(
+            self.get_lattice_matrix(), positions, numbers, symprec=self.symprec
+        )
+        if symmetry == None:
+            raise Exception("Could not determine the symmetry of the structure.")
+
+        permutations = site_permutations(
+            positions, numbers, symmetry["rotations"], symmetry["translations"]
+        )
+        configurations = distinct_spin_configurations(permutations, sites, net_moment)
+
+        patterns = {}
+        for spins in configurations:
+            pattern = np.full(len(numbers), "n")
+            pattern[sites] = np.where(spins, "u", "d")
+
+            name = "F" if spins.all() else f"AF{len(patterns) + 1 - ('F' in patterns)}"
+            patterns[name] = pattern.tolist()
+
+        return patterns
 
-        return self.atoms[index]
+    def get_supercell_structure(self):
+        """The supercell as a structure of its own (cell multiples 1), atoms in the .struct/.poscar order."""
+        positions, numbers = self.get_supercell_arrays()
+        structure = self.copy()
+        structure.a = self.a * self.cell_multiples["a"]
+        structure.b = self.b * self.cell_multiples["b"]
+        structure.c = self.c * self.cell_multiples["c"]
+        structure.cell_multiples = {"a": 1, "b": 1, "c": 1}
+        structure.positions = positions
+        structure.numbers = numbers
+        return structure
+
+    def generate_substitutions(self, host_species, dopant_species, count=None, concentration=None):
+        """Lazily yields a supercell structure for every symmetry-distinct way of replacing count
+        (or the given fraction) of the supercell atoms of the host species by the dopant species.
+        The supercell's own operations only prune the candidates, the operations of the parent cell it lost
+        (e.g. the translation along a doubled axis) are caught by the fingerprint."""
+        host = atomic_number(host_species) if isinstance(host_species, str) else int(host_species)
+        dopant = atomic_number(dopant_species) if isinstance(dopant_species, str) else int(dopant_species)
+
+        supercell = self.get_supercell_structure()
+        sites = np.flatnonzero(supercell.numbers == host)
+        if count == None:
+            count = int(round((concentration or 0.0) * len(sites)))
+        if count < 0 or count > len(sites):
+            raise Exception(f"Cannot substitute {count} of {len(sites)} {element_symbol(host)} atoms.")
+
+        symmetry = detect_symmetry(
+            supercell.get_lattice_matrix(), supercell.positions, supercell.numbers, symprec=self.symprec
+        )
+        if symmetry == None:
+            raise Exception("Could not determine the symmetry of the structure.")
+        permutations = site_permutations(
+            supercell.positions, supercell.numbers, symmetry["rotations"], symmetry["translations"]
+        )
+
+        fingerprints = set()
+        for indices in distinct_subsets(permutations, sites, count):
+            structure = supercell.copy()
+            structure.title = f"{self.title} {element_symbol(dopant)}{count}"
+            structure.numbers[indices] = dopant
+
+            fingerprint = structure.fingerprint()
+            if fingerprint in fingerprints:
+                continue
+            fingerprints.add(fingerprint)
+
+            structure.add_tweak_message(
+                f"Substitution : {element_symbol(host)} -> {element_symbol(dopant)} : atoms {indices.tolist()}"
+            )
+            yield structure
+
+    # --------------- NEIGHBOURS ---------------
+
+    def get_neighbours(self, count=None):
+        """Distances (N,count) in angstroms and atom indices (N,count) of the nearest neighbours of every supercell atom
+        (periodic images included), atoms in the order of get_supercell_arrays, sorted by distance."""
+        positions, numbers = self.get_supercell_arrays()
+        lattice_matrix = self.get_lattice_matrix()
+        count = count or StructureFile.NEIGHBOUR_COUNT
+
+        # replicate the cell far enough to hold the neighbours, about 3 mean interatomic spacings
+        volume = abs(np.linalg.det(lattice_matrix))
+        spacing = (volume / len(numbers)) ** (1.0 / 3.0) * max(1.0, count / 12) ** (1.0 / 3.0)
+        heights = volume / np.linalg.norm(
+            np.cross(lattice_matrix[[1, 2, 0]], lattice_matrix[[2, 0, 1]]), axis=1
+        )
+        reach = np.maximum(1, np.ceil(3 * spacing / heights)).astype(int)
+        shifts = np.indices(2 * reach + 1).reshape(3, -1).T - reach
+
+        images = ((positions[None, :, :] + shifts[:, None, :]).reshape(-1, 3)) @ lattice_matrix
+        tree = scipy_spatial.cKDTree(images)
+
+        # the closest hit is the atom itself
+        count = min(count, len(images) - 1)
+        distances, hits = tree.query(positions @ lattice_matrix, k=count + 1)
+        return distances[:, 1:], hits[:, 1:] % len(numbers)
+
+    def suggest_rmt(self, reduction_percentage=0):
+        """Muffin-tin radii (bohr) by atomic number that touch but do not overlap,
+        each neighbour distance split in the ratio of the covalent radii (like setrmt)."""
+        _, numbers = self.get_supercell_arrays()
+        distances, neighbours = self.get_neighbours()
+
+        covalent = np.array(
+            lmap(numbers, lambda Z: element_properties(Z).covalent_radius)
+        )
+        shares = covalent[:, None] / (covalent[:, None] + covalent[neighbours])
+        limits = (distances * shares).min(axis=1) / Constants.bohr_to_angstrom
+
+        rmt = {}
+        for Z in np.unique(numbers):
+            radius = limits[numbers == Z].min() * (1 - reduction_percentage / 100)
+            # round down so that rounding never creates an overlap
+            rmt[int(Z)] = float(
+                np.floor(min(radius, StructureFile.MAX_RMT) * 100) / 100
+            )
+        return rmt
+
+    def tweak_rmt(self, rmt=None, reduction_percentage=0):
+        """Sets the muffin-tin radii (bohr) by atomic number, the suggested ones if none are given.
+        init_lapw keeps them with accept_radii="d"."""
+        rmt = rmt if rmt != None else self.suggest_rmt(reduction_percentage)
+        for Z, radius in rmt.items():
+            self.add_tweak_message(
+                f"RMT {element_symbol(Z)} : {self.rmt.get(Z, StructureFile.DEFAULT_RMT)} -> {radius}"
+            )
+            self.rmt[int(Z)] = radius
+
+    def find_overlaps(self, rmt=None):
+        """Pairs of supercell atoms whose muffin-tin spheres overlap with the given (or the structure's) radii,
+        as (i, j, distance in bohr, overlap in bohr) sorted by the overlap."""
+        _, numbers = self.get_supercell_arrays()
+        distances, neighbours = self.get_neighbours()
+        distances = distances / Constants.bohr_to_angstrom
+
+        rmt = rmt if rmt != None else self.rmt
+        radii = np.array(lmap(numbers, lambda Z: rmt.get(int(Z), StructureFile.DEFAULT_RMT)))
+        overlaps = radii[:, None] + radii[neighbours] - distances
+
+        # every pair only once
+        atoms = np.broadcast_to(np.arange(len(numbers))[:, None], neighbours.shape)
+        mask = (overlaps > 1e-6) & (atoms <= neighbours)
+        order = np.argsort(-overlaps[mask])
+        return list(
+            zip(
+                atoms[mask][order].tolist(),
+                neighbours[mask][order].tolist(),
+                distances[mask][order].tolist(),
+                overlaps[mask][order].tolist(),
+            )
+        )
+
+    def check_overlaps(self, keep_radii=False):
+        """Raises if no radii can be fitted (atoms closer than two minimal spheres) or,
+        when the radii of the struct are kept by init_lapw, if any of them overlap."""
+        distances, neighbours = self.get_neighbours(1)
+        closest = distances.min() / Constants.bohr_to_angstrom
+        if closest < 2 * StructureFile.MIN_RMT:
+            raise Exception(
+                f"Atoms {closest:.3f} bohr apart, no muffin-tin radii can fit (structure rejected)."
+            )
+
+        if keep_radii:
+            overlaps = self.find_overlaps()
+            if len(overlaps) > 0:
+                i, j, distance, overlap = overlaps[0]
+                raise Exception(
+                    f"{len(overlaps)} overlapping muffin-tin spheres, the worst between atoms {i} and {j}"
+                    f" ({distance:.3f} bohr apart, {overlap:.3f} bohr overlap) (structure rejected)."
+                )
 
     # --------------- OUTPUT ---------------
 
+    def get_lattice_matrix(self, with_multiples=True):
+        """Lattice vectors (rows, in angstroms), of the whole supercell by default."""
+        aa = self.cell_multiples["a"] if with_multiples else 1
+        bb = self.cell_multiples["b"] if with_multiples else 1
+        cc = self.cell_multiples["c"] if with_multiples else 1
+
+        return np.asarray(
+            pyxtal_lattice.para2matrix(
+                (self.a * aa, self.b * bb, self.c * cc, self.alpha, self.beta, self.gamma),
+                False,
+            )
+        )
+
+    def get_supercell_arrays(self):
+        """Fractional positions and atomic numbers of the whole supercell,
+        stably sorted by atomic number (the atom order of the generated files)."""
+        multiples = np.array(
+            [self.cell_multiples["a"], self.cell_multiples["b"], self.cell_multiples["c"]]
+        )
+
+        # replica shifts in the a, b, c nesting order
+        shifts = np.indices(multiples).reshape(3, -1).T
+        positions = (
+            (self.positions[None, :, :] + shifts[:, None, :]) / multiples
+        ).reshape(-1, 3)
+        numbers = np.tile(self.numbers, len(shifts))
+
+        order = np.argsort(numbers, kind="stable")
+        return positions[order], numbers[order]
+
     def generate_poscar(self):
         # returns the .poscar file with tweaks done to it
         text = f"{self.title}\n"
         text += f"1.0 Ang\n"
 
-        # cell multiples
-        aa = self.cell_multiples["a"]
-        bb = self.cell_multiples["b"]
-        cc = self.cell_multiples["c"]
-
         # generate the lattice matrix
-        lattice_matrix = para2matrix(
-            (self.a * aa, self.b * bb, self.c * cc, self.alpha, self.beta, self.gamma),
-            False,
-        )
+        lattice_matrix = self.get_lattice_matrix()
 
         # write the lattice matrix
         text += f"{lattice_matrix[0][0]:.16f} {lattice_matrix[0][1]:.16f} {lattice_matrix[0][2]:.16f}\n"
         text += f"{lattice_matrix[1][0]:.16f} {lattice_matrix[1][1]:.16f} {lattice_matrix[1][2]:.16f}\n"
         text += f"{lattice_matrix[2][0]:.16f} {lattice_matrix[2][1]:.16f} {lattice_matrix[2][2]:.16f}\n"
 
-        # copy and sort atoms by atomic number
-        sorted_atoms = []
-        for _a in range(aa):
-            for _b in range(bb):
-                for _c in range(cc):
-                    sorted_atoms += [
-                        StructureAtom(
-                            (a.x + _a) / aa, (a.y + _b) / bb, (a.z + _c) / cc, a.Z
-                        )
-                        for a in list(self.atoms)
-                    ]
-        sorted_atoms.sort(key=lambda a: a.Z)
+        # supercell atoms sorted by atomic number
+        positions, numbers = self.get_supercell_arrays()
 
         # count the occurences
-        counts = {}
-        for a in sorted_atoms:
-            if a.Z not in counts:
-                counts[a.Z] = 0
-            counts[a.Z] += 1
+        species, counts = np.unique(numbers, return_counts=True)
+        symbols = element_symbols(species)
 
         # atom types/symbols
-        for atom_number in counts.keys():
-            text += f"{mendeleev.element(int(atom_number)).symbol} "
-        text += "\n"
+        text += "".join(lmap(symbols, lambda symbol: f"{symbol} ")) + "\n"
 
         # atom counts
-        for atom_number in counts.keys():
-            text += f"{counts[atom_number]} "
-        text += "\n"
-
+        text += "".join(lmap(counts, lambda count: f"{count} ")) + "\n"
 
         text += "Direct\n"
 
-        # write out all atom positions
-        for a in sorted_atoms:
-            text += f"{a.x:.16f} {a.y:.16f} {a.z:.16f} {mendeleev.element(int(a.Z)).symbol}\n"
-        self.non_eq_count = len(sorted_atoms)
+        # write out all atom positions in one formatting pass
+        rows = np.empty((len(numbers), 4), dtype=object)
+        rows[:, :3] = positions
+        rows[:, 3] = element_symbols(numbers)
+        text += ("%.16f %.16f %.16f %s\n" * len(numbers)) % tuple(rows.ravel())
+
+        return text
+
+    def generate_struct(self):
+        # returns the wien2k .struct file of the supercell with tweaks done to it
+        F = StructureFile.LINE_FORMATS
+        multiples = [self.cell_multiples["a"], self.cell_multiples["b"], self.cell_multiples["c"]]
+        positions, numbers = self.get_supercell_arrays()
+
+        # groups of equivalent atoms and the symmetry operations relating them
+        self.update_symmetry()
+        groups = self.get_equivalent_atom_groups()
+        rotations, translations = self.symmetry_rotations, self.symmetry_translations
+
+        lengths = np.array([self.a, self.b, self.c]) * multiples / Constants.bohr_to_angstrom
+        is_cubic = (
+            np.allclose(lengths, lengths[0])
+            and np.allclose([self.alpha, self.beta, self.gamma], 90.0)
+        )
+
+        text = StructureFile.apply_format(F[1], [self.title])
+        text += StructureFile.apply_format(F[2], ["P", len(groups)])
+        text += StructureFile.apply_format(F[3], ["RELA"])
+        text += StructureFile.apply_format(
+            F[4], list(lengths) + [self.alpha, self.beta, self.gamma]
+        )
+
+        species_counts = {}
+        for group_id, group in enumerate(groups):
+            Z = int(numbers[group[0]])
+            species_counts[Z] = species_counts.get(Z, 0) + 1
+
+            # positive indices only for cubic cells
+            atom_index = (group_id + 1) if is_cubic else -(group_id + 1)
+            for i, atom_id in enumerate(group):
+                text += StructureFile.apply_format(
+                    F[5], [atom_index] + list(positions[atom_id] % 1.0)
+                )
+                if i == 0:
+                    text += StructureFile.apply_format(
+                        F[6], [len(group), StructureFile.DEFAULT_ISPLIT]
+                    )
+
+            text += StructureFile.apply_format(
+                F[7],
+                [
+                    f"{element_symbol(Z)}{species_counts[Z]}",
+                    StructureFile.DEFAULT_NPT,
+                    StructureFile.default_R0(Z),
+                    self.rmt.get(Z, StructureFile.DEFAULT_RMT),
+                    Z,
+                ],
+            )
+            text += StructureFile.apply_format(F[8], [1.0, 0.0, 0.0])
+            text += StructureFile.apply_format(F[9], [0.0, 1.0, 0.0])
+            text += StructureFile.apply_format(F[10], [0.0, 0.0, 1.0])
+
+        # symmetry operations
+        text += StructureFile.apply_format(F[11], [len(rotations)])
+        for i in range(len(rotations)):
+            for row in range(3):
+                text += StructureFile.apply_format(
+                    F[12 + row], list(rotations[i][row]) + [translations[i][row] % 1.0]
+                )
+            text += StructureFile.apply_format(F[15], [i + 1])
 
         return text
 
@@ -0,0 +1,338 @@
+from wien2_helper import *
+
+import numpy as np
+import itertools, functools, hashlib
+
+# optional dependency, imported on first use
+spglib = lazy_import("spglib")
+
+
+def _dataset_value(dataset, key):
+    # spglib < 2.1 returns dicts, newer versions return dataclasses
+    if isinstance(dataset, dict):
+        return dataset[key]
+    return getattr(dataset, key)
+
+
+def moment_labels(moments):
+    """Integer label per atom for any per-atom moment description.
+    Accepts u/d/n flags, signed numbers or (N,k) rows (e.g. flags of several configurations side by side)."""
+    moments = np.asarray(moments)
+    if moments.ndim == 1:
+        moments = moments[:, None]
+
+    _, labels = np.unique(moments, axis=0, return_inverse=True)
+    return labels.reshape(-1)
+
+
+def detect_symmetry(lattice, positions, numbers, moments=None, symprec=1e-5):
+    """Space group of a cell whose atoms are told apart by atomic number and, if given, magnetic moment.
+    Atoms with different moments are never made equivalent (collinear magnetism, no time reversal),
+    which matches how wien2k treats spin up/down atoms.
+
+    Returns a dict with the spacegroup symbol and number, the rotations (M,3,3), translations (M,3)
+    and equivalent_atoms (N,), or None if spglib fails."""
+    numbers = np.asarray(numbers, dtype=int)
+
+    types = numbers
+    if moments is not None:
+        # fold the moment labels into the atom types
+        types = numbers * (len(numbers) + 1) + moment_labels(moments)
+
+    dataset = spglib.get_symmetry_dataset(
+        (np.asarray(lattice), np.asarray(positions), types), symprec=symprec
+    )
+    if dataset == None:
+        return None
+
+    return {
+        "spacegroup_symbol": _dataset_value(dataset, "international"),
+        "spacegroup_number": int(_dataset_value(dataset, "number")),
+        "rotations": np.asarray(_dataset_value(dataset, "rotations"), dtype=int),
+        "translations": np.asarray(_dataset_value(dataset, "translations"), dtype=float),
+        "equivalent_atoms": np.asarray(_dataset_value(dataset, "equivalent_atoms"), dtype=int),
+    }
+
+
+def equivalence_groups(equivalent_atoms):
+    """Lists of atom indices of each equivalence class, ordered by the first appearance of the class."""
+    equivalent_atoms = np.asarray(equivalent_atoms)
+    _, first, inverse = np.unique(equivalent_atoms, return_index=True, return_inverse=True)
+
+    # renumber the classes by the order of their first atom
+    order = np.argsort(np.argsort(first))
+    class_ids = order[inverse.reshape(-1)]
+
+    atom_order = np.argsort(class_ids, kind="stable")
+    bounds = np.cumsum(np.bincount(class_ids))[:-1]
+    return lmap(np.split(atom_order, bounds), lambda group: group.tolist())
+
+
+def _periodic_clusters(points, species, tol):
+    """Cluster label of each fractional point: the lowest index of the points of the same species within
+    about tol of it (periodically). Points closer than tol/2 in every coordinate always share a label.
+    Hashing on 8 grids shifted by half a bin catches the pairs that a single grid splits at a bin edge."""
+    bins = int(round(1.0 / tol))
+    scaled = (np.asarray(points) % 1.0) * bins
+    species = np.asarray(species, dtype=np.int64)
+
+    # cell keys of every shifted grid, the last bin wraps onto 0 so 0.99999 and 0.0 collide
+    partitions = []
+    for shift in np.indices((2, 2, 2)).reshape(3, -1).T * 0.5:
+        grid = np.floor(scaled + shift).astype(np.int64) % bins
+        packed = ((species * bins + grid[:, 0]) * bins + grid[:, 1]) * bins + grid[:, 2]
+        partitions.append(np.unique(packed, return_inverse=True)[1].reshape(-1))
+
+    # propagate the lowest index through the shared cells until nothing changes
+    labels = np.arange(len(scaled))
+    while True:
+        previous = labels
+        for cells in partitions:
+            lowest = np.full(cells.max(initial=0) + 1, len(scaled))
+            np.minimum.at(lowest, cells, labels)
+            labels = lowest[cells]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def expand_orbits(positions, numbers, rotations, translations, moments=None, tol=1e-4):
+    """Applies all symmetry operations (the whole group, not just its generators) to the given atoms at once
+    and returns every distinct atom of the cell: positions (K,3), atomic numbers (K,), orbit ids (K,) and
+    moments (K,3) or None. Moments are axial vectors in the lattice basis.
+    Input atoms that are images of each other end up in the same orbit, orbit ids follow the input order."""
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    numbers = np.asarray(numbers, dtype=int).reshape(-1)
+    rotations = np.asarray(rotations, dtype=float).reshape(-1, 3, 3)
+    translations = np.asarray(translations, dtype=float).reshape(-1, 3)
+    N, M = len(positions), len(rotations)
+
+    # (M,N,3) images of every atom under every operation
+    images = np.einsum("mij,nj->mni", rotations, positions) + translations[:, None, :]
+    images = (images % 1.0).reshape(-1, 3)
+    images[np.isclose(images, 1.0, rtol=0.0, atol=tol)] = 0.0
+    sources = np.tile(np.arange(N), M)
+
+    # atoms are told apart by position, atomic number and (rounded) moment
+    species = numbers[sources]
+    image_moments = None
+    if moments is not None:
+        moments = np.asarray(moments, dtype=float).reshape(-1, 3)
+        # axial vectors do not flip under inversion
+        determinants = np.rint(np.linalg.det(rotations))
+        image_moments = (
+            determinants[:, None, None]
+            * np.einsum("mij,nj->mni", rotations, moments)
+        ).reshape(-1, 3)
+        species = moment_labels(
+            np.hstack([species[:, None], np.rint(image_moments / tol).astype(np.int64)])
+        )
+
+    labels = _periodic_clusters(images, species, tol)
+
+    # orbit of an input atom: the lowest input atom with an image on it
+    owners = np.full(len(images), N, dtype=int)
+    np.minimum.at(owners, labels, sources)
+    is_identity = np.all(np.isclose(rotations, np.eye(3)), axis=(1, 2)) & np.all(
+        np.isclose(translations % 1.0, 0.0, atol=tol) | np.isclose(translations % 1.0, 1.0, atol=tol),
+        axis=1,
+    )
+    if not is_identity.any():
+        raise Exception("The symmetry operations do not contain the identity.")
+    identity = np.argmax(is_identity)
+    source_owner = owners[labels[identity * N + np.arange(N)]]
+    _, orbit_of_source = np.unique(source_owner, return_inverse=True)
+
+    # one copy of each distinct atom, in the order of the orbits
+    first = np.flatnonzero(labels == np.arange(len(images)))
+    kept = first[np.argsort(orbit_of_source[sources[first]], kind="stable")]
+    orbit_ids = orbit_of_source[sources[kept]]
+
+    return (
+        images[kept],
+        numbers[sources[kept]],
+        orbit_ids,
+        image_moments[kept] if image_moments is not None else None,
+    )
+
+
+def site_permutations(positions, numbers, rotations, translations, tol=1e-4):
+    """(M,N) permutations of the atoms by each symmetry operation: operation m moves atom i onto atom permutations[m, i]."""
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    numbers = np.asarray(numbers, dtype=int).reshape(-1)
+    rotations = np.asarray(rotations, dtype=float).reshape(-1, 3, 3)
+    translations = np.asarray(translations, dtype=float).reshape(-1, 3)
+    N, M = len(positions), len(rotations)
+
+    images = np.einsum("mij,nj->mni", rotations, positions) + translations[:, None, :]
+
+    # the atoms come first, so an image clustered with an atom is labelled by that atom's index
+    labels = _periodic_clusters(
+        np.vstack([positions, images.reshape(-1, 3)]),
+        np.tile(numbers, M + 1),
+        tol,
+    )
+    permutations = labels[N:]
+    if np.any(permutations >= N):
+        raise Exception("The symmetry operations do not map the atoms onto each other.")
+
+    return permutations.reshape(M, N)
+
+
+def _restrict_permutations(permutations, sites):
+    # the distinct permutations of the chosen sites among themselves, as positions within the sites array
+    position_of = np.full(permutations.shape[1], -1, dtype=int)
+    position_of[sites] = np.arange(len(sites))
+    restricted = position_of[permutations[:, sites]]
+    if np.any(restricted < 0):
+        raise Exception("The symmetry operations move the chosen sites onto other sites.")
+    return np.unique(restricted, axis=0)
+
+
+def distinct_spin_configurations(permutations, sites, net_moment=None, chunk_size=1 << 16):
+    """All collinear up/down assignments of the given sites that are distinct up to the permutations
+    and a global spin flip, as (K,len(sites)) booleans (True = up), the ferromagnet first.
+    Configurations are found through their form with the lowest code (bit j = site j is up) and returned
+    flipped to have at least as many up spins as down ones (and the first site up on a tie).
+    With net_moment only |#up - #down| == net_moment is kept."""
+    sites = np.asarray(sites, dtype=int)
+    k = len(sites)
+    if k == 0:
+        return np.zeros((1, 0), dtype=bool)
+    if k > 40:
+        raise Exception(f"Too many magnetic sites to enumerate ({k}).")
+
+    site_permutations = _restrict_permutations(permutations, sites)
+
+    weights = np.left_shift(np.int64(1), np.arange(k, dtype=np.int64))
+    full = (np.int64(1) << k) - 1
+
+    canonical_codes = []
+    for start in range(0, 1 << k, chunk_size):
+        codes = np.arange(start, min(start + chunk_size, 1 << k), dtype=np.int64)
+        spins = ((codes[:, None] >> np.arange(k)) & 1).astype(bool)
+
+        if net_moment != None:
+            ups = spins.sum(axis=1)
+            keep = np.abs(2 * ups - k) == net_moment
+            codes, spins = codes[keep], spins[keep]
+
+        canonical = np.minimum(codes, full ^ codes)
+        for permutation in site_permutations:
+            # the spin of site j moves onto site permutation[j]
+            moved = np.zeros_like(spins)
+            moved[:, permutation] = spins
+            moved_codes = moved @ weights
+            canonical = np.minimum(canonical, np.minimum(moved_codes, full ^ moved_codes))
+
+        # a configuration is kept only through its canonical representative
+        canonical_codes.append(codes[codes == canonical])
+
+    codes = np.sort(np.concatenate(canonical_codes))
+    spins = ((codes[:, None] >> np.arange(k)) & 1).astype(bool)
+
+    balance = 2 * spins.sum(axis=1) - k
+    flip = (balance < 0) | ((balance == 0) & ~spins[:, 0])
+    spins[flip] = ~spins[flip]
+    return spins
+
+
+def distinct_subsets(permutations, sites, count, chunk_elements=1 << 22):
+    """Lazily yields every choice of count of the sites that is distinct up to the permutations,
+    as sorted arrays of atom indices. Each class is yielded once, through its member with the lowest
+    canonical code (bit j = site j chosen, up to 62 sites, lexicographic order of the sorted indices beyond),
+    so nothing has to be remembered between chunks and the choices can be streamed."""
+    sites = np.asarray(sites, dtype=int)
+    if count == 0:
+        yield sites[:0]
+        return
+    site_permutations = _restrict_permutations(permutations, sites)
+    # keep the (C,M,count) image arrays of a chunk around chunk_elements entries
+    chunk_size = max(1, chunk_elements // (len(site_permutations) * count))
+    weights = np.left_shift(np.int64(1), np.arange(len(sites), dtype=np.int64))
+
+    combinations = itertools.combinations(range(len(sites)), count)
+    while True:
+        chunk = np.array(list(itertools.islice(combinations, chunk_size)), dtype=int)
+        if len(chunk) == 0:
+            return
+        chunk = chunk.reshape(-1, count)
+
+        # (C,M,count) images of every choice under every permutation
+        images = site_permutations[:, chunk].transpose(1, 0, 2)
+        if len(sites) <= 62:
+            codes = weights[chunk].sum(axis=1)
+            is_canonical = weights[images].sum(axis=2).min(axis=1) == codes
+        else:
+            differences = np.sort(images, axis=2) - chunk[:, None, :]
+            first_difference = np.argmax(differences != 0, axis=2)
+            sign = np.take_along_axis(differences, first_difference[:, :, None], axis=2)
+            is_canonical = np.all(sign >= 0, axis=(1, 2))
+
+        for choice in chunk[is_canonical]:
+            yield sites[choice]
+
+
+@functools.lru_cache(maxsize=None)
+def _unimodular_matrices():
+    # all integer 3x3 matrices with entries -1/0/1 and determinant +-1, candidates for the lattice automorphisms
+    matrices = np.array(list(itertools.product((-1, 0, 1), repeat=9))).reshape(-1, 3, 3)
+    return matrices[np.abs(np.rint(np.linalg.det(matrices))) == 1]
+
+
+def canonical_fingerprint(lattice, positions, types, symprec=1e-5, tol=1e-3, length_decimals=3):
+    """Hash that is the same for every description of the same crystal (atom order, origin, supercell,
+    choice of basis), as long as the atoms are within tol (fractional) and the lengths within the rounding.
+    The cell is reduced to its primitive Niggli cell, then the lowest quantized, sorted atom list
+    over all automorphisms of the reduced lattice and all origins on atoms of the rarest type is hashed."""
+    cell = (np.asarray(lattice), np.asarray(positions), np.asarray(types, dtype=int))
+    primitive = spglib.standardize_cell(cell, to_primitive=True, symprec=symprec)
+    if primitive is not None:
+        cell = primitive
+    lattice, positions, types = cell
+
+    reduced = spglib.niggli_reduce(lattice)
+    if reduced is None:
+        reduced = lattice
+    # fractional coordinates in the reduced basis
+    positions = np.asarray(positions) @ lattice @ np.linalg.inv(reduced)
+    types = np.asarray(types, dtype=np.int64)
+
+    # the reduced metric is the same for every automorphism of the lattice
+    metric = reduced @ reduced.T
+    lengths = np.sqrt(np.diag(metric))
+    cosines = [metric[1, 2], metric[0, 2], metric[0, 1]] / (lengths[[1, 0, 0]] * lengths[[2, 2, 1]])
+    lattice_key = np.round(np.concatenate([lengths, np.degrees(np.arccos(cosines))]), length_decimals)
+
+    matrices = _unimodular_matrices()
+    transformed = np.einsum("aij,jk,alk->ail", matrices, metric, matrices)
+    automorphisms = matrices[
+        np.all(np.isclose(transformed, metric, atol=symprec * np.abs(metric).max() * 10), axis=(1, 2))
+    ]
+
+    # origins on the atoms of the rarest type
+    species, counts = np.unique(types, return_counts=True)
+    origins = np.flatnonzero(types == species[np.argmin(counts)])
+
+    # a power of two number of bins keeps decimal coordinates (like 0.3295) clear of the bin edges
+    bins = 1 << int(np.ceil(np.log2(1.0 / tol)))
+    candidates = []
+    for matrix in automorphisms:
+        # new basis rows A @ reduced, so the fractional coordinates go with inv(A)
+        grid = np.rint((positions @ np.linalg.inv(matrix)) * bins).astype(np.int64)
+        # (O,N) grid coordinates relative to every origin, packed with the type into one sortable integer per atom
+        relative = (grid[None, :, :] - grid[origins, None, :]) % bins
+        packed = ((types * bins + relative[:, :, 0]) * bins + relative[:, :, 1]) * bins + relative[:, :, 2]
+        candidates.append(np.sort(packed, axis=1))
+
+    # lexicographically lowest candidate, column by column
+    best = np.concatenate(candidates)
+    for column in range(best.shape[1]):
+        best = best[best[:, column] == best[:, column].min()]
+        if len(best) == 1:
+            break
+    best = best[0]
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(lattice_key.tobytes())
+    digest.update(best.tobytes())
+    return digest.hexdigest()